@@ -0,0 +1,111 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from webelementsparsers import UserAgentParser
+
+# asyncio interface of the parsers for services reading raw strings from sockets or other
+# async sources. The parsing itself runs in an executor so that long user agents do not block
+# the event loop; at most concurrency batches are in the executor at once and the source is
+# not read further until one of them is done, so a slow consumer holds back the source
+
+
+def parse_batch(parser_class, items, flat=False, fields=None):
+    # Executor entry point, at module level so that it can also be sent to a ProcessPoolExecutor
+    return list(parser_class.parse_many(items, flat=flat, fields=fields))
+
+
+async def _batches(items, batch_size):
+    # lists of up to batch_size items of an async (or plain) iterable; the last one may be shorter
+    batch = []
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    else:
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    if len(batch) > 0:
+        yield batch
+
+
+async def parse_item(item, parser_class=UserAgentParser, flat=False, fields=None, executor=None):
+    # Parses a single raw string in executor (the default executor of the loop when None)
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(executor, parse_batch, parser_class, (item,), flat, fields)
+
+    return results[0]
+
+
+async def parse_stream(items, parser_class=UserAgentParser, flat=False, fields=None, concurrency=4,
+                       ordered=True, batch_size=1, executor=None):
+    # Parses an async iterable of raw strings, yielding (item, result) pairs where result is
+    # what parser_class.parse_many would yield for the item. With ordered the pairs follow the
+    # input order, otherwise each batch is delivered as soon as it is parsed. Larger batches
+    # spend less time handing items to the executor but wait for batch_size items of the
+    # source. Without an executor a pool of concurrency threads is used, and shut down when
+    # the stream ends or is closed
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    loop = asyncio.get_running_loop()
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    source = _batches(items, batch_size)
+    next_batch = None  # task reading the next batch of the source
+    exhausted = False
+    pending = deque()  # (batch, future) in submission order
+    try:
+        while True:
+            if next_batch is None and not exhausted and len(pending) < concurrency:
+                next_batch = asyncio.ensure_future(source.__anext__())
+
+            if next_batch is None and len(pending) == 0:
+                return
+
+            # wake up for the next batch of the source, or a parsed batch which can be delivered
+            if ordered:
+                waiting = [pending[0][1]] if len(pending) > 0 else []
+            else:
+                waiting = [future for _, future in pending]
+            if next_batch is not None:
+                waiting.append(next_batch)
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+            if next_batch is not None and next_batch.done():
+                try:
+                    batch = next_batch.result()
+                except StopAsyncIteration:
+                    exhausted = True
+                else:
+                    pending.append((batch, loop.run_in_executor(
+                        executor, parse_batch, parser_class, batch, flat, fields)))
+                next_batch = None
+
+            if ordered:
+                while len(pending) > 0 and pending[0][1].done():
+                    batch, future = pending.popleft()
+                    for pair in zip(batch, future.result()):
+                        yield pair
+            else:
+                done = [entry for entry in pending if entry[1].done()]
+                pending = deque(entry for entry in pending if not entry[1].done())
+                for batch, future in done:
+                    for pair in zip(batch, future.result()):
+                        yield pair
+    finally:
+        if next_batch is not None:
+            next_batch.cancel()
+        for _, future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False)
@@ -0,0 +1,305 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from benchmark_corpus import user_agent_corpus, url_corpus
+from columnar import parse_columns
+from profiling import StageProfiler
+from webelementsparsers import UserAgentParser, URLParser, is_bot
+
+_DONE = object()
+
+
+def _as_object(parser_class):
+    return lambda items: (parser_class(item).parse() for item in items)
+
+
+def _as_dictionary(parser_class):
+    def run(items):
+        for item in items:
+            parser = parser_class(item).parse()
+            yield None if parser is None else parser.components_as_dictionary()
+
+    return run
+
+
+def _as_flat_dictionary(parser_class):
+    def run(items):
+        for item in items:
+            parser = parser_class(item).parse()
+            yield None if parser is None else parser.components_as_flat_dictionary()
+
+    return run
+
+
+def _as_batch(parser_class):
+    return lambda items: parser_class.parse_many(items, flat=True)
+
+
+def _as_columns(parser_class):
+    def run(items):
+        yield parse_columns(parser_class, items)
+
+    return run
+
+
+# output modes timed for each parser: (name, builder, per_item) where the builder turns a parser
+# class into a function from a list of items to an iterator of results. Modes without per_item
+# produce a single result for the whole batch, so only their throughput is reported
+output_modes = [
+    ("object", _as_object, True),
+    ("dictionary", _as_dictionary, True),
+    ("flat_dictionary", _as_flat_dictionary, True),
+    ("parse_many_flat", _as_batch, True),
+    ("columnar", _as_columns, False),
+]
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def measure(run, items, repeat=3, per_item=True):
+    # Returns the throughput over repeat passes and, for per-item modes, the p50/p99 latency of
+    # producing each single result
+    for _ in run(items[:50]):  # warm up lazy imports and caches so they are not timed
+        pass
+
+    clock = time.perf_counter
+    latencies = []
+    elapsed = 0.0
+    for _ in range(repeat):
+        results = run(items)
+        started = clock()
+        if per_item:
+            while True:
+                item_started = clock()
+                if next(results, _DONE) is _DONE:
+                    break
+                latencies.append(clock() - item_started)
+        else:
+            for _ in results:
+                pass
+        elapsed += clock() - started
+
+    measurement = {"items_per_s": repeat * len(items) / elapsed, "p50_us": None, "p99_us": None}
+    if per_item:
+        latencies.sort()
+        measurement["p50_us"] = _percentile(latencies, 0.50) * 1e6
+        measurement["p99_us"] = _percentile(latencies, 0.99) * 1e6
+
+    return measurement
+
+
+def peak_memory_kib(run, items):
+    # Peak traced memory while producing the batch and keeping every result alive
+    tracemalloc.start()
+    results = list(run(items))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del results
+
+    return peak / 1024
+
+
+def run_suite(size=2000, repeat=3):
+    user_agents = [user_agent for _, user_agent in user_agent_corpus(size)]
+    urls = url_corpus(size)
+
+    results = {}
+    for parser_name, parser_class, items in (("user_agent", UserAgentParser, user_agents),
+                                             ("url", URLParser, urls)):
+        for mode_name, build, per_item in output_modes:
+            run = build(parser_class)
+            measurement = measure(run, items, repeat, per_item)
+            measurement["peak_kib"] = peak_memory_kib(run, items)
+            results["%s.%s" % (parser_name, mode_name)] = measurement
+
+    run = lambda items: (is_bot(item) for item in items)
+    results["user_agent.is_bot"] = measure(run, user_agents, repeat)
+    results["user_agent.is_bot"]["peak_kib"] = peak_memory_kib(run, user_agents)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "size": size,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+# +1 when a larger value is worse, -1 when a smaller value is worse
+metric_directions = {"items_per_s": -1, "p50_us": 1, "p99_us": 1, "peak_kib": 1}
+
+
+def compare_runs(old, new, threshold=0.10):
+    # Returns (benchmark, metric, old value, new value, relative change) for every metric of new
+    # that is worse than in old by more than threshold
+    regressions = []
+    for name, new_measurement in new["results"].items():
+        old_measurement = old["results"].get(name)
+        if old_measurement is None:
+            continue
+
+        for metric, direction in metric_directions.items():
+            old_value = old_measurement.get(metric)
+            new_value = new_measurement.get(metric)
+            if not old_value or new_value is None:
+                continue
+
+            change = (new_value - old_value) / old_value
+            if change * direction > threshold:
+                regressions.append((name, metric, old_value, new_value, change))
+
+    return regressions
+
+
+def _format(value):
+    return "-" if value is None else "%.2f" % value
+
+
+def print_suite(suite):
+    print("%-28s %12s %10s %10s %12s" % ("benchmark", "items/s", "p50 us", "p99 us", "peak KiB"))
+    for name, measurement in suite["results"].items():
+        print("%-28s %12s %10s %10s %12s" % (
+            name, _format(measurement["items_per_s"]), _format(measurement["p50_us"]),
+            _format(measurement["p99_us"]), _format(measurement["peak_kib"])))
+
+
+def memory_per_result(parse, items):
+    # Returns the mean number of bytes held by each parse result that is kept alive
+    for item in items[:50]:  # warm up imports and caches so they are not counted
+        parse(item)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [parse(item) for item in items]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (after - before) / len(results)
+
+
+def benchmark_memory(size=2000):
+    return {
+        "user_agent_result_bytes": memory_per_result(
+            lambda item: UserAgentParser(item).parse(), [user_agent for _, user_agent in user_agent_corpus(size)]),
+        "url_result_bytes": memory_per_result(
+            lambda item: URLParser(item).parse(), url_corpus(size)),
+    }
+
+
+# adversarial inputs which made the earlier backtracking patterns super-linear
+pathological_user_agents = {
+    "nested_rv": lambda size: "Mozilla/5.0 (" + "a; " * size,
+    "adjacent_gaps": lambda size: "Mozilla/ (" + "a) AppleWebKit/ (" * size,
+    "compatible_bot": lambda size: "(compatible; " + "http://a" * size,
+    "linked_bot": lambda size: "a/b (" + "(+http://a" * size,
+}
+
+pathological_urls = {
+    "host_run": lambda size: "http://" + "a" * size + "!",
+    "query_marks": lambda size: "http://a/" + "?" * size,
+}
+
+
+class UnboundedUserAgentParser(UserAgentParser):
+    max_length = None
+
+
+class UnboundedURLParser(URLParser):
+    max_length = None
+
+
+def benchmark_pathological(sizes=(1000, 2000, 4000, 8000)):
+    # Milliseconds per parse of each adversarial input at growing sizes, with the length limit
+    # lifted; linear-time matching shows as time roughly doubling with the size
+    results = {}
+    for cases, parser_class in ((pathological_user_agents, UnboundedUserAgentParser),
+                                (pathological_urls, UnboundedURLParser)):
+        run = _as_object(parser_class)
+        for name, build in cases.items():
+            for size in sizes:
+                measurement = measure(run, [build(size)], repeat=3)
+                results["%s_%d_ms" % (name, size)] = 1000 / measurement["items_per_s"]
+
+    return results
+
+
+def profile_stages(size=2000):
+    # Parses both corpora into dictionaries with a profiler attached and returns the profiler
+    user_agents = [user_agent for _, user_agent in user_agent_corpus(size)]
+    urls = url_corpus(size)
+    for _ in _as_dictionary(UserAgentParser)(user_agents[:50]):  # keep lazy imports out of the timings
+        pass
+
+    profiler = StageProfiler()
+    UserAgentParser.profiler = URLParser.profiler = profiler
+    try:
+        for _ in _as_dictionary(UserAgentParser)(user_agents):
+            pass
+        for _ in _as_dictionary(URLParser)(urls):
+            pass
+    finally:
+        UserAgentParser.profiler = URLParser.profiler = None
+
+    return profiler
+
+
+def main(argv=None):
+    argument_parser = argparse.ArgumentParser(
+        description="Benchmark the parsers on a synthetic corpus, or compare two saved runs")
+    argument_parser.add_argument("--size", type=int, default=2000, help="items in each corpus")
+    argument_parser.add_argument("--repeat", type=int, default=3, help="timed passes over each corpus")
+    argument_parser.add_argument("--output", help="also write the results as JSON to this file")
+    argument_parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                                 help="compare two saved runs and exit with status 1 on regressions")
+    argument_parser.add_argument("--threshold", type=float, default=0.10,
+                                 help="relative change counted as a regression (default: 0.10)")
+    argument_parser.add_argument("--memory", action="store_true",
+                                 help="measure the memory held per parse result")
+    argument_parser.add_argument("--pathological", action="store_true",
+                                 help="time adversarial inputs of growing size")
+    argument_parser.add_argument("--profile", action="store_true",
+                                 help="print per-stage timings and pattern hits in Prometheus text format")
+    args = argument_parser.parse_args(argv)
+
+    if args.compare is not None:
+        with open(args.compare[0]) as old_file, open(args.compare[1]) as new_file:
+            regressions = compare_runs(json.load(old_file), json.load(new_file), args.threshold)
+        for name, metric, old_value, new_value, change in regressions:
+            print("regression %-28s %-12s %12.2f -> %12.2f (%+.1f%%)" % (
+                name, metric, old_value, new_value, change * 100))
+        if len(regressions) == 0:
+            print("no regressions above %.0f%%" % (args.threshold * 100))
+
+        return 1 if len(regressions) > 0 else 0
+
+    if args.profile:
+        sys.stdout.write(profile_stages(args.size).to_prometheus())
+
+        return 0
+
+    if args.memory or args.pathological:
+        results = benchmark_memory(args.size) if args.memory else benchmark_pathological()
+        for name, value in results.items():
+            print("%-28s %10.2f" % (name, value))
+
+        return 0
+
+    suite = run_suite(args.size, args.repeat)
+    print_suite(suite)
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump(suite, output, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import random
+
+# Synthetic, reproducible corpora for benchmark.py. The user agents cover every branch of
+# UserAgentParser._extract_details and both bot rules; the urls cover ports, userinfo, queries,
+# fragments, language prefixes, files and IPv4/IPv6 hosts
+
+windows_platforms = ["Windows NT 10.0; Win64; x64", "Windows NT 6.1; WOW64", "Windows NT 6.3; Win64; x64"]
+mac_platforms = ["Macintosh; Intel Mac OS X 10_15_7", "Macintosh; Intel Mac OS X 13_5_2"]
+linux_platforms = ["X11; Linux x86_64", "X11; Ubuntu; Linux x86_64"]
+android_platforms = ["Linux; Android 10; K", "Linux; Android 13; SM-S911B", "Linux; Android 9; Pixel 3"]
+ios_platforms = ["iPhone; CPU iPhone OS 16_6 like Mac OS X", "iPad; CPU OS 17_0 like Mac OS X",
+                 "iPod touch; CPU iPhone OS 12_0 like Mac OS X"]
+
+user_agent_templates = [
+    # firefox
+    ("firefox", "Mozilla/5.0 ({platform}; rv:{gecko}) Gecko/20100101 Firefox/{version}",
+     windows_platforms + mac_platforms + linux_platforms),
+    ("firefox", "Mozilla/5.0 (Android 13; Mobile; rv:{gecko}) Gecko/{version} Firefox/{version}", [""]),
+    # chrome
+    ("chrome", "Mozilla/5.0 ({platform}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{version} Safari/537.36",
+     windows_platforms + mac_platforms + linux_platforms),
+    ("chrome", "Mozilla/5.0 ({platform}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{version} Mobile Safari/537.36",
+     android_platforms),
+    # opera
+    ("opera", "Mozilla/5.0 ({platform}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{version} Safari/537.36 OPR/{minor}.0.0.0",
+     windows_platforms + mac_platforms),
+    # safari
+    ("safari", "Mozilla/5.0 ({platform}) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{minor}.6 Safari/605.1.15",
+     mac_platforms),
+    ("safari", "Mozilla/5.0 ({platform}) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{minor}.6 Mobile/15E148 Safari/604.1",
+     ios_platforms),
+    ("safari", "Safari/{build} CFNetwork/1327.0.4 Darwin/21.2.0 (x86_64)", [""]),
+    ("safari", "MobileSafari/{build} CFNetwork/1404.0.5 Darwin/22.3.0", [""]),
+    # ie
+    ("ie", "Mozilla/4.0 (compatible; MSIE 6.0; {platform}; SV1; .NET CLR 1.1.4322)", ["Windows NT 5.1"]),
+    ("ie", "Mozilla/5.0 (compatible; MSIE {ie}.0; {platform}; Trident/6.0)", ["Windows NT 6.2; WOW64", "Windows NT 6.1"]),
+    # browserless
+    ("browserless", "Mozilla/5.0 ({platform}) AppleWebKit/605.1.15 (KHTML, like Gecko)", mac_platforms),
+    ("browserless", "Mozilla/5.0 ({platform}) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148", ios_platforms),
+    ("browserless", "Mozilla/5.0", [""]),
+    ("browserless", "curl/7.{minor}.1", [""]),
+    ("browserless", "curl/7.29.0 (x86_64-redhat-linux-gnu) libcurl/7.29.0 NSS/3.44 zlib/1.2.7 libidn/1.28", [""]),
+    ("browserless", "python-requests/2.{minor}.0", [""]),
+    ("browserless", "Safari/{build} CFNetwork/1128.0.1 Darwin/19.6.0", [""]),
+    ("browserless", "Opera/9.80 ({platform}) Presto/2.12.388 Version/12.14", ["Windows NT 6.0"]),
+    ("browserless", "com.apple.WebKit.WebContent/{build} CFNetwork/1404.0.5 Darwin/22.3.0", [""]),
+    ("browserless", "com.apple.WebKit.WebContent/17614 CFNetwork/1494.0.7 Darwin/23.0.0 (x86_64)", [""]),
+    # bots
+    ("bot", "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", [""]),
+    ("bot", "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)", [""]),
+    ("bot", "Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)", [""]),
+    ("bot", "Mozilla/5.0 ({platform}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{version} Mobile Safari/537.36 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+     android_platforms),
+    ("bot", "Mozilla/5.0 ({platform}; rv:{gecko}) Gecko/20100101 Firefox/{version} (compatible; Crawly/1.0; +https://crawly.example.com/about)",
+     linux_platforms),
+    ("bot", "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)", [""]),
+    ("bot", "Twitterbot/1.0 (+https://dev.twitter.com/docs/cards)", [""]),
+    # not recognised
+    ("unknown", "garbage without a product", [""]),
+    ("unknown", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Gecko-like/beta", [""]),
+]
+
+url_templates = [
+    "https://www.{domain}/",
+    "https://{domain}/{language}/products/item-{number}.html",
+    "http://{domain}:{port}/path/to/file-{number}.pdf",
+    "https://user:secret@{domain}/secure/",
+    "ftp://ftp.{domain}/pub/archive-{number}.tar",
+    "https://www.{domain}/search?q=term{number}&lang={language}&page=2",
+    "https://www.{domain}/search?q=term{number};lang={language}",
+    "https://www.{domain}/docs/page{number}#section{number}",
+    "https://shop.{domain}/{language}/cart?item={number}&utm_source=mail&utm_medium=email#top",
+    "http://192.168.{small}.{small}/admin/",
+    "http://[2001:db8::{small}]/index.html",
+    "http://[2001:db8::{small}]:{port}/index.html",
+    "wss://stream.{domain}/live",
+    "redis://localhost:6379/{small}",
+    "https://{domain}/v1/users/:id/orders",
+    "https://{domain}",
+    "not a url {number}",
+]
+
+domains = ["example.com", "example.org", "example.co.uk", "shop.example.net", "news.example.de", "example.io"]
+languages = ["en", "de", "fr", "es", "ja", "xx"]
+
+
+def user_agent_corpus(size=2000, seed=0):
+    # Returns (branch, user_agent) pairs; every template appears before any is repeated
+    generator = random.Random(seed)
+    corpus = []
+    while len(corpus) < size:
+        for branch, template, platforms in user_agent_templates:
+            corpus.append((branch, template.format(
+                platform=generator.choice(platforms),
+                gecko="%d.0" % generator.randint(60, 120),
+                version="%d.0.%d.%d" % (generator.randint(90, 120), generator.randint(0, 6000), generator.randint(0, 200)),
+                minor=generator.randint(10, 99),
+                build="%d.%d.%d" % (generator.randint(600, 18000), generator.randint(1, 9), generator.randint(1, 20)),
+                ie=generator.randint(7, 10),
+            )))
+            if len(corpus) == size:
+                break
+
+    return corpus
+
+
+def url_corpus(size=2000, seed=0):
+    generator = random.Random(seed)
+    corpus = []
+    while len(corpus) < size:
+        for template in url_templates:
+            corpus.append(template.format(
+                domain=generator.choice(domains),
+                language=generator.choice(languages),
+                number=generator.randint(1, 99999),
+                port=generator.choice([8080, 8443, 3000, 9000]),
+                small=generator.randint(1, 254),
+            ))
+            if len(corpus) == size:
+                break
+
+    return corpus
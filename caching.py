@@ -0,0 +1,215 @@
+import hashlib
+import json
+import sqlite3
+from collections import OrderedDict
+from types import MappingProxyType
+
+_MISSING = object()
+
+
+def freeze(value):
+    # Turns a parse result into a read-only structure that can be shared between callers
+    if isinstance(value, dict):
+        return MappingProxyType(dict((key, freeze(item)) for key, item in value.items()))
+    elif isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+
+    return value
+
+
+def _frozen_sequence(items):
+    return tuple(_frozen_sequence(item) if type(item) is list else item for item in items)
+
+
+def _frozen_object(dictionary):
+    # json object_hook giving the structure of freeze() while decoding; the nested objects are
+    # already frozen when the outer one is decoded
+    for key, value in dictionary.items():
+        if type(value) is list:
+            dictionary[key] = _frozen_sequence(value)
+
+    return MappingProxyType(dictionary)
+
+
+_frozen_decoder = json.JSONDecoder(object_hook=_frozen_object)
+
+
+class LRUCache:
+    # Size-bounded cache of parse results keyed on the raw string, evicting the least recently used
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteCache:
+    # Parse results kept in a sqlite database file, shared by the worker processes of a host and
+    # kept across restarts; use one instance per process (or thread). Takes the (parser class,
+    # item, flat, fields) keys of Parser.parse_many and stores each result under a digest of the
+    # key and of the rules version of the parser class, so that results of changed rules are
+    # never returned; prune() removes them from the file. The memory_size most recently used
+    # results are also kept in memory, under the rules version as well, so that repeated items
+    # are not read and decoded again. The rules are checked on every lookup by the identity of
+    # the rules_tables() of the class, so change a table by assigning a new one (as
+    # UserAgentParser.register_devices does) rather than in place
+
+    def __init__(self, path, timeout=30.0, memory_size=10000):
+        self.path = path
+        self.memory = LRUCache(memory_size) if memory_size > 0 else None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._versions = {}
+        # autocommit, with the write-ahead log so that readers do not wait for the writer
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, rules_version TEXT, value TEXT)")
+        # entries there were to start from, by rules version
+        self._initial_counts = dict(self._connection.execute(
+            "SELECT rules_version, COUNT(*) FROM results GROUP BY rules_version"))
+
+    def _rules_version(self, parser_class):
+        # rules_version() digests every table, so it is only computed again when one of them has
+        # been replaced since the last lookup
+        tables = parser_class.rules_tables()
+        memo = self._versions.get(parser_class)
+        if memo is not None and len(memo[0]) == len(tables) and \
+                all(table is known for table, known in zip(tables, memo[0])):
+            return memo[1]
+
+        version = parser_class.rules_version()
+        self._versions[parser_class] = (tables, version)
+        return version
+
+    def _digest(self, key, version):
+        _, item, flat, fields = key
+        text = "\0".join((version, "flat" if flat else "", ",".join(sorted(fields or ())), item))
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __contains__(self, key):
+        digest = self._digest(key, self._rules_version(key[0]))
+        return self._connection.execute("SELECT 1 FROM results WHERE key = ?", (digest,)).fetchone() is not None
+
+    def get(self, key, default=None):
+        version = self._rules_version(key[0])
+        memory = self.memory
+        if memory is not None:
+            value = memory.get((version, key), _MISSING)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+
+        digest = self._digest(key, version)
+        row = self._connection.execute("SELECT value FROM results WHERE key = ?", (digest,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        value = _frozen_decoder.decode(row[0])
+        if memory is not None:
+            memory.put((version, key), value)
+
+        return value
+
+    def put(self, key, value):
+        version = self._rules_version(key[0])
+        if self.memory is not None:
+            self.memory.put((version, key), value)
+
+        digest = self._digest(key, version)
+        self._connection.execute("INSERT OR REPLACE INTO results (key, rules_version, value) VALUES (?, ?, ?)",
+                                 (digest, version, json.dumps(value, default=dict)))
+        self.writes += 1
+
+    def prune(self, parser_classes, max_entries=None):
+        # Removes the entries of other rules versions than those of parser_classes, then the
+        # oldest entries beyond max_entries; returns the number of removed entries
+        versions = [self._rules_version(parser_class) for parser_class in parser_classes]
+        removed = self._connection.execute(
+            "DELETE FROM results WHERE rules_version NOT IN (%s)" % ", ".join("?" * len(versions)),
+            versions).rowcount
+        if max_entries is not None:
+            removed += self._connection.execute(
+                "DELETE FROM results WHERE rowid NOT IN (SELECT rowid FROM results ORDER BY rowid DESC LIMIT ?)",
+                (max_entries,)).rowcount
+
+        return removed
+
+    def clear(self):
+        if self.memory is not None:
+            self.memory.clear()
+        self._connection.execute("DELETE FROM results")
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self, parser_classes=None):
+        # initial_size counts the entries there were to start from which parser_classes (by
+        # default those looked up so far) can still return, initial_stale those of other rules
+        if parser_classes is None:
+            parser_classes = list(self._versions)
+        versions = set(self._rules_version(parser_class) for parser_class in parser_classes)
+        initial_size = sum(count for version, count in self._initial_counts.items() if version in versions)
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "size": len(self),
+            "initial_size": initial_size,
+            "initial_stale": sum(self._initial_counts.values()) - initial_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
@@ -0,0 +1,79 @@
+import json
+from webelementsparsers import UserAgentParser, URLParser
+
+try:
+    # pip3 install pyarrow (optional, only needed for Arrow tables and Parquet files)
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def parse_columns(parser_class, items, columns=None, cache=None):
+    # Parses the items and returns their flat fields as columns: a dictionary of equal-length lists
+    # keyed by flat field name, with None where an item has no value. Without explicit columns the
+    # schema is every field seen in the batch, in order of first appearance; a column named twice
+    # is returned once
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))
+    column_data = {} if columns is None else dict((column, []) for column in columns)
+    row_count = 0
+    for flat_dictionary in parser_class.parse_many(items, flat=True, cache=cache):
+        if flat_dictionary is None:
+            flat_dictionary = {}
+
+        if columns is None:
+            for key, value in flat_dictionary.items():
+                column = column_data.get(key)
+                if column is None:
+                    column = column_data[key] = [None] * row_count
+                column.append(value)
+        else:
+            for column in columns:
+                column_data[column].append(flat_dictionary.get(column))
+
+        row_count += 1
+        if len(column_data) > len(flat_dictionary):
+            for column in column_data.values():
+                if len(column) < row_count:
+                    column.append(None)
+
+    return column_data
+
+
+def parse_user_agent_columns(user_agents, columns=None, cache=None):
+    return parse_columns(UserAgentParser, user_agents, columns, cache)
+
+
+def parse_url_columns(urls, columns=None, cache=None):
+    return parse_columns(URLParser, urls, columns, cache)
+
+
+def _as_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    elif isinstance(value, (dict, list, tuple)):
+        return json.dumps(value)
+
+    return str(value)
+
+
+def to_arrow_table(column_data):
+    # Columns whose values do not share one Arrow type (e.g. ports given as int and str) are
+    # stored as strings
+    if pyarrow is None:
+        raise ImportError("pyarrow is required for Arrow output: pip3 install pyarrow")
+
+    arrays = []
+    for values in column_data.values():
+        try:
+            arrays.append(pyarrow.array(values))
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError):
+            arrays.append(pyarrow.array([_as_text(value) for value in values], type=pyarrow.string()))
+
+    return pyarrow.Table.from_arrays(arrays, names=list(column_data.keys()))
+
+
+def write_parquet(column_data, path):
+    table = to_arrow_table(column_data)
+    pyarrow.parquet.write_table(table, path)
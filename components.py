@@ -1,12 +1,87 @@
-import re
-# pip3 install iso-639
-from iso639 import languages
+import patterns
+import public_suffixes
+from query_strings import QueryString
+from language_codes import alpha2_codes
 
 
-class Browser:
+class Component:
+    # Base of the parsed components; flat_fields names the values returned by field_values(),
+    # in the same order as the keys of get_as_dict()
+
+    __slots__ = ()
+    component_type = None
+    flat_fields = ()
+
+    def field_values(self):
+        return ()
+
+    def get_as_dict(self):
+        pass
+
+
+_flat_suffixes_cache = {}
+_scalar_types = (str, int, float, bool)
+
+
+def _flat_keys(component_class, prefix):
+    # The ".field" suffixes of a component type are computed once; only the layout is cached,
+    # not the keys of every prefix, so that the cache stays as small as the set of classes
+    suffixes = _flat_suffixes_cache.get(component_class)
+    if suffixes is None:
+        suffixes = _flat_suffixes_cache[component_class] = tuple(
+            "." + field for field in component_class.flat_fields)
+
+    return [prefix + suffix for suffix in suffixes]
+
+
+def _list_keys(prefix, length):
+    # built on each call, as the lengths come from the input
+    prefix += "."
+    return [prefix + str(index) for index in range(1, length + 1)]
+
+
+def flatten(items, raw_keys=()):
+    # Flattens (key, value) pairs into a single level dictionary with dotted keys, walking the
+    # component objects directly instead of their nested dictionaries. List elements are numbered
+    # from 1, scalars are kept, None values outside lists are dropped and the keys in raw_keys keep
+    # their value untouched
+    flat_dictionary = {}
+    stack = [(iter(items), False)]
+    while stack:
+        pairs, in_list = stack[-1]
+        for key, value in pairs:
+            if type(value) in _scalar_types:
+                flat_dictionary[key] = value
+            elif value is None:
+                if in_list or key in raw_keys:
+                    flat_dictionary[key] = value
+            elif isinstance(value, Component):
+                stack.append((zip(_flat_keys(type(value), key), value.field_values()), False))
+                break
+            elif key in raw_keys:
+                flat_dictionary[key] = value
+            elif isinstance(value, dict):
+                stack.append((zip([key + "." + item_key for item_key in value], value.values()), False))
+                break
+            elif in_list:
+                flat_dictionary[key] = value
+            elif isinstance(value, list):
+                stack.append((zip(_list_keys(key, len(value)), value), True))
+                break
+            elif isinstance(value, _scalar_types):
+                flat_dictionary[key] = value
+        else:
+            stack.pop()
+
+    return flat_dictionary
+
+
+class Browser(Component):
     # The browser of the user-agent
 
     component_type = "browser"
+    __slots__ = ("browser", "browser_version", "compatibility", "gecko_release_version")
+    flat_fields = ("browser_name", "browser_version", "compatibility", "gecko_release_version")
 
     def __init__(self, browser, compatibility=None, gecko_release_version=None, version=None):
         browser = browser.split("/")
@@ -22,6 +97,9 @@ class Browser:
         self.compatibility = compatibility
         self.gecko_release_version = gecko_release_version
 
+    def field_values(self):
+        return (self.browser, self.browser_version, self.compatibility, self.gecko_release_version)
+
     def get_as_dict(self):
         return {
             "browser_name": self.browser,
@@ -31,33 +109,38 @@ class Browser:
         }
 
 
-class OS:
+class OS(Component):
     # Native platform the browser is running on
 
     component_type = "os"
+    __slots__ = ("os", "compatibilities", "os_version")
+    flat_fields = ("os_name", "compatibilities", "os_version")
 
-    def __init__(self, os, devices_list):
+    def __init__(self, os, devices=frozenset()):
         self.os = []
         self.compatibilities = []
         self.os_version = None
 
         if isinstance(os, str):
-            for term in os.split("; "):
-                if bool(re.match(r".*x\d+(_\d+)?.*", term)):
-                    self.os_version = term
-                elif bool(re.match(r"^.+/.+", term)):
-                    self.compatibilities.append(term)
-                elif term not in [None, ""] + devices_list:
-                    self.os.append(term)
-
-        elif isinstance(os, list):
-            for term in os:
-                if bool(re.match(r".*x\d+(_\d+)?.*", term)):
-                    self.os_version = term
-                elif bool(re.match(r"^.+/.+", term)):
-                    self.compatibilities.append(term)
-                elif term not in [None, ""] + devices_list:
-                    self.os.append(term)
+            os = os.split("; ")
+        elif not isinstance(os, list):
+            return
+
+        for term in os:
+            self.add_term(term, devices)
+
+    def add_term(self, term, devices=frozenset()):
+        # Puts a platform term in the version, compatibility or name bucket; device names are
+        # left out
+        if patterns.os_version_pattern.match(term):
+            self.os_version = term
+        elif patterns.has_product_slash(term):
+            self.compatibilities.append(term)
+        elif term and term not in devices:
+            self.os.append(term)
+
+    def field_values(self):
+        return (self.os, self.compatibilities, self.os_version)
 
     def get_as_dict(self):
         return {
@@ -67,10 +150,12 @@ class OS:
         }
 
 
-class Product:
+class Product(Component):
     # The general token that says the browser is Mozilla compatible
 
     component_type = "product"
+    __slots__ = ("product", "product_version")
+    flat_fields = ("product_name", "product_version")
 
     def __init__(self, product):
         product = product.split("/")
@@ -80,6 +165,9 @@ class Product:
         else:
             self.product_version = None
 
+    def field_values(self):
+        return (self.product, self.product_version)
+
     def get_as_dict(self):
         return {
             "product_name": self.product,
@@ -87,18 +175,18 @@ class Product:
         }
 
 
-class Bot:
+class Bot(Component):
     # The bot/crawler which is running
 
     component_type = "bot"
+    __slots__ = ("bot", "bot_version", "target_url", "url_parser", "_target_link")
+    flat_fields = ("bot_name", "bot_version", "target_link")
 
     def __init__(self, bot, url_parser):
-        if bool(re.match(r"\+?https?://.+/.*", bot)):
+        if patterns.bot_url_pattern.match(bot):
             self.bot = None
             self.bot_version = None
-            self.target_link = url_parser(bot)
-            if self.target_link is not None:
-                self.target_link = self.target_link.parse().components_as_dictionary()
+            self.target_url = bot
         else:
             bot_temp = bot.split("; ")
             splitted_bot = bot_temp[1].split("/")
@@ -107,15 +195,24 @@ class Bot:
             self.bot_version = splitted_bot[1] if len(
                 splitted_bot) == 2 else None
             if bot_temp[2][0] == "+":
-                self.target_link = url_parser(bot_temp[2][1:])
-                if self.target_link is not None:
-                    self.target_link = self.target_link.parse().components_as_dictionary()
+                self.target_url = bot_temp[2][1:]
             else:
-                self.target_link = url_parser(bot_temp[2])
-                if self.target_link is not None:
-                    self.target_link = self.target_link.parse().components_as_dictionary()
+                self.target_url = bot_temp[2]
 
         self.url_parser = url_parser
+        self._target_link = None
+
+    @property
+    def target_link(self):
+        # The target link is only parsed the first time it is read
+        if self._target_link is None:
+            self._target_link = self.url_parser(
+                self.target_url).parse().components_as_dictionary()
+
+        return self._target_link
+
+    def field_values(self):
+        return (self.bot, self.bot_version, self.target_link)
 
     def get_as_dict(self):
         return {
@@ -125,9 +222,11 @@ class Bot:
         }
 
 
-class Device:
+class Device(Component):
 
     component_type = "device"
+    __slots__ = ("device", "device_build")
+    flat_fields = ("device_name", "device_build")
 
     def __init__(self, device_name, device_build=None):
         self.device = device_name
@@ -136,6 +235,9 @@ class Device:
         self.device_build = device_build[1] if device_build is not None and len(
             device_build) > 1 else None
 
+    def field_values(self):
+        return (self.device, self.device_build)
+
     def get_as_dict(self):
         return {
             "device_name": self.device,
@@ -143,61 +245,89 @@ class Device:
         }
 
 
-class Domain:
+class Domain(Component):
 
     component_type = "domain"
+    __slots__ = ("domain", "top_level_domain", "second_level_domain", "other_level_domains",
+                 "registrable_domain", "user_info")
+    flat_fields = ("top_level_domain", "second_level_domain", "other_level_domains", "registrable_domain")
+
+    # also split on the private section of the Public Suffix List (e.g. "github.io"), not only
+    # on the suffixes operated by registries (e.g. "co.uk")
+    private_suffixes = False
 
     def __init__(self, domain):
         self.domain = domain
         self.top_level_domain = None
         self.second_level_domain = None
         self.other_level_domains = None
+        self.registrable_domain = None
 
         self._separate_parts()
 
     def _separate_parts(self):
         userinfo_host_parts = self.domain.split("@")
         if len(userinfo_host_parts) == 1:  # there is no format userinfo@host
-            if bool(re.match(r"\[.+\]", self.domain)):  # ipv6
-                splitted_domain = [self.domain[1:-1]]
-            # ipv4
-            elif bool(re.match(r"\d+\.\d+\.\d+\.\d+", self.domain)):
-                splitted_domain = [self.domain]
-            else:
-                splitted_domain = self.domain.split(".")
-
+            host = self.domain
         else:  # format: userinfo@host
             if ":" in userinfo_host_parts[0]:  # format: username:password
                 self.user_info = userinfo_host_parts[0].split(":")
             else:  # format: blah.blah
                 self.user_info = userinfo_host_parts[0].split(".")
 
-            if bool(re.match(r"\[.+\]", userinfo_host_parts[1])):  # ipv6
-                splitted_domain = [userinfo_host_parts[1][1:-1]]
-            # ipv4
-            elif bool(re.match(r"\d+\.\d+\.\d+\.\d+", userinfo_host_parts[1])):
-                splitted_domain = [userinfo_host_parts[1]]
-            else:
-                splitted_domain = userinfo_host_parts[1].split(".")
-
-        self.top_level_domain = splitted_domain[-1]
-        if len(splitted_domain) > 1:
-            self.second_level_domain = splitted_domain[-2]
-
-            if len(splitted_domain) > 2:
-                self.other_level_domains = splitted_domain[:-2]
+            host = userinfo_host_parts[1]
+
+        # a port left on the host (e.g. "example.co.uk:8080") is not part of its last label
+        port = patterns.host_port_suffix_pattern.search(host)
+        if port is not None:
+            host = host[:port.start()]
+
+        if patterns.ipv6_host_pattern.match(host):  # ipv6
+            self.top_level_domain = host[1:-1]
+            return
+        if patterns.ipv4_host_pattern.match(host):  # ipv4
+            self.top_level_domain = host
+            return
+
+        # the top level domain is the public suffix of the host (e.g. "co.uk"), the second level
+        # domain the label before it, which together make the registrable domain; a fully
+        # qualified host ("example.co.uk.") ends with an empty label, which is not part of them
+        if host.endswith("."):
+            host = host[:-1]
+        labels = host.split(".")
+        length = public_suffixes.suffix_length(labels, self.private_suffixes)
+        self.top_level_domain = ".".join(labels[-length:])
+        if len(labels) > length and "" not in labels[-length - 1:]:
+            self.second_level_domain = labels[-length - 1]
+            self.registrable_domain = ".".join(labels[-length - 1:])
+
+            if len(labels) > length + 1:
+                self.other_level_domains = labels[:-length - 1]
+
+    def field_values(self):
+        return (self.top_level_domain, self.second_level_domain, self.other_level_domains,
+                self.registrable_domain)
 
     def get_as_dict(self):
         return {
             "top_level_domain": self.top_level_domain,
             "second_level_domain": self.second_level_domain,
             "other_level_domains": self.other_level_domains,
+            "registrable_domain": self.registrable_domain,
         }
 
 
-class Subdirectories:
+class Subdirectories(Component):
 
     component_type = "subdirectories"
+    __slots__ = ("subdirectories", "cleaned_subdirectories", "language")
+    flat_fields = ("subdirectories", "language")
+
+    # codes taken as the language of a url when they are its first path segment; e.g. add
+    # language_codes.alpha3_codes to also recognise three-letter codes
+    language_codes = alpha2_codes
+    # also recognise a code followed by a region, e.g. "en-us" or "pt_BR"
+    region_variants = False
 
     def __init__(self, subdirectories):
         self.subdirectories = subdirectories
@@ -215,12 +345,22 @@ class Subdirectories:
         self.cleaned_subdirectories = [
             item for item in self.subdirectories if item != "" and item[0] != ":"]
 
-        try:
-            languages.get(alpha2=self.cleaned_subdirectories[0])
-            self.language = self.cleaned_subdirectories[0]
-            self.cleaned_subdirectories.pop(0)
-        except Exception:
-            pass
+        if len(self.cleaned_subdirectories) > 0 and self._is_language(self.cleaned_subdirectories[0]):
+            self.language = self.cleaned_subdirectories.pop(0)
+
+    def _is_language(self, segment):
+        if segment in self.language_codes:
+            return True
+        elif not self.region_variants:
+            return False
+
+        language, separator, region = segment.replace("_", "-").partition("-")
+
+        return (separator != "" and language in self.language_codes
+                and ((len(region) == 2 and region.isalpha()) or (len(region) == 3 and region.isdigit())))
+
+    def field_values(self):
+        return (self.cleaned_subdirectories, self.language)
 
     def get_as_dict(self):
         return {
@@ -229,15 +369,26 @@ class Subdirectories:
         }
 
 
-class Query:
+class Query(Component):
 
     component_type = "query"
+    __slots__ = ("query_text", "path", "fragment_identifiers", "query", "parameters")
+    flat_fields = ("path", "query")
+
+    # keys kept in query, e.g. {"utm_source", "gclid"}; the other parameters are skipped
+    # without being copied out of the url
+    query_keys = None
+    # with query_keys, stop reading a query once each of the keys has been found; a repeated
+    # key then keeps its first value instead of its last
+    query_stop_early = True
 
     def __init__(self, query_text):
         self.query_text = query_text
         self.path = []
         self.fragment_identifiers = []
         self.query = None
+        # query_strings.QueryString of the last query, for repeated keys and decoded values
+        self.parameters = None
 
         self._separate_parts()
 
@@ -250,16 +401,12 @@ class Query:
                 self.path.append(Subdirectories(item))
 
     def _process_query(self, item):
-        # common query delimiters: ? ;
-        item_parts = item.split("&")
-        if len(item_parts) < 2:
-            item_parts = item.split(";")
-
-        parts = []
-        for part in item_parts:
-            parts.append(tuple(part.split("=")))
+        # common query delimiters: & ; (the raw text of the last value of every key is kept)
+        self.parameters = QueryString(item, self.query_keys, self.query_stop_early)
+        self.query = self.parameters.as_dict(raw=True)
 
-        self.query = dict(parts)
+    def field_values(self):
+        return (self.path, self.query)
 
     def get_as_dict(self):
         return {
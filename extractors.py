@@ -0,0 +1,159 @@
+from components import Product, OS, Browser, Device
+import patterns
+
+# Builders of the detail extractors of UserAgentParser. Each rule of UserAgentParser.detail_rules
+# names one of the kinds below and the options it is built with; the result is a function of the
+# parser which appends the Device, OS and Browser components (and sets the layout engine) after
+# a single pass over the raw components
+
+
+def _extract_devices(parser, terms, device_build=None):
+    # Appends a Device for every device term and returns the other terms
+    devices = parser.devices
+    others = []
+    for term in terms:
+        if term in devices:
+            parser.components.append(Device(term, device_build=device_build))
+        else:
+            others.append(term)
+
+    return others
+
+
+def _is_compatibility(element, bot_status):
+    return patterns.has_product_slash(element) and not (bot_status and patterns.is_compatible_bot_token(element))
+
+
+def platform_extractor(browser_token=None, browser_choice="first", excluded=(), compatibility_from=4,
+                       version_token=None, device_build_token=None, gecko_release_version=False,
+                       layout_engine=True, os_first=True, skip_bare_mozilla=False):
+    # For "Mozilla/<version> (<platform>) <engine> (<engine details>) <products>..." user agents:
+    # the devices and OS come from the platform group, the browser is the product containing
+    # browser_token ("first" one, or the "single" one with the classification as fallback), and
+    # the other products from compatibility_from on which contain none of the excluded tokens
+    # are the compatibility list. version_token and device_build_token pick the browser version
+    # and the device build among the same products when exactly one contains them
+    def extract(parser):
+        raw_components = parser.raw_components
+        if skip_bare_mozilla and patterns.bare_mozilla_pattern.match(raw_components[0]):
+            return
+
+        details = raw_components[1].split("; ")
+        gecko_version = None
+        if gecko_release_version:
+            gecko_version = details[-1]
+            details.remove(details[-1])
+
+        bot_status = parser.bot_status
+        browsers = []
+        versions = []
+        device_builds = []
+        compatibility = []
+        for index, element in enumerate(raw_components[2:], 2):
+            if browser_token is not None and browser_token in element:
+                browsers.append(element)
+            if index < compatibility_from:
+                continue
+
+            if version_token is not None and version_token in element:
+                versions.append(element)
+            if device_build_token is not None and device_build_token in element:
+                device_builds.append(element)
+
+            for token in excluded:
+                if token in element:
+                    break
+            else:
+                if _is_compatibility(element, bot_status):
+                    compatibility.append(Product(element))
+
+        # each platform term goes to a Device or to the name, version or compatibilities of the OS
+        devices = parser.devices
+        device_build = device_builds[0] if len(device_builds) == 1 else None
+        os = OS([], devices)
+        for term in details:
+            if term in devices:
+                parser.components.append(Device(term, device_build=device_build))
+            else:
+                os.add_term(term, devices)
+
+        if browser_token is None:
+            browser = ""
+        elif browser_choice == "single":
+            browser = browsers[0] if len(browsers) == 1 else parser.browser.capitalize() + "/"
+        else:
+            browser = browsers[0]
+
+        browser = Browser(browser, compatibility=compatibility, gecko_release_version=gecko_version,
+                          version=versions[0] if len(versions) == 1 else None)
+        if os_first:
+            parser.components.append(os)
+            parser.components.append(browser)
+        else:
+            parser.components.append(browser)
+            parser.components.append(os)
+
+        if layout_engine:
+            parser.layout_browser_engine = Product(raw_components[2])
+
+    return extract
+
+
+def product_list_extractor(browser="", compatibility_from=1, os_name=None, os_from=None):
+    # For "<product>/<version> <products>..." user agents: every following product is a
+    # compatibility. The OS is os_name, followed by the first token which is not a product
+    # (os_from="leftover"), or the token after the leading product (os_from="token", in which
+    # case nothing is extracted without it)
+    def extract(parser):
+        raw_components = parser.raw_components
+        if os_from == "token" and len(raw_components) < 2:
+            return
+
+        bot_status = parser.bot_status
+        compatibility = []
+        leftover = None
+        for index, element in enumerate(raw_components[1:], 1):
+            if _is_compatibility(element, bot_status):
+                if index >= compatibility_from:
+                    compatibility.append(Product(element))
+            elif leftover is None:
+                leftover = element
+
+        if os_from == "token":
+            os = raw_components[1] + "; "
+        elif os_from == "leftover" and leftover is not None:
+            os = os_name + "; " + leftover
+        else:
+            os = os_name
+
+        parser.components.append(OS(os, parser.devices))
+        parser.components.append(Browser(browser, compatibility=compatibility))
+
+    return extract
+
+
+def ie_extractor():
+    # For "Mozilla/<version> (compatible; MSIE <version>; <os>; <products>...)" user agents
+    def extract(parser):
+        details = parser.raw_components[1].split("; ")
+        compatibility = _extract_devices(parser, details[3:])
+
+        parser.components.append(OS(details[2], parser.devices))
+        parser.components.append(Browser(details[1].replace(" ", "/"),
+                                         compatibility=[Product(item) for item in compatibility]))
+
+    return extract
+
+
+extractor_kinds = {
+    "platform": platform_extractor,
+    "product_list": product_list_extractor,
+    "ie": ie_extractor,
+}
+
+
+def compile_detail_rules(rules):
+    # Builds the extractor of every (classification, product token, kind, options) rule, keyed on
+    # (classification, product token)
+    return dict(((classification, product_token), extractor_kinds[kind](**options))
+                for classification, product_token, kind, options in rules)
@@ -0,0 +1,45 @@
+import os
+import sys
+
+# Writes language_codes.py from the iso639 package, so that the package is only needed to
+# regenerate the tables and not at run time:
+#     python3 generate_language_codes.py  # pip3 install iso-639
+
+header = """# Generated by generate_language_codes.py from the iso639 package, do not edit.
+# Language codes recognised as the first path segment of a url, see components.Subdirectories
+
+"""
+
+
+def _table(name, codes):
+    lines = []
+    line = "   "
+    for code in sorted(codes):
+        item = ' "%s",' % code
+        if len(line) + len(item) > 100:
+            lines.append(line)
+            line = "   "
+        line += item
+    lines.append(line)
+
+    return "%s = frozenset((\n%s\n))\n" % (name, "\n".join(lines))
+
+
+def main(path=None):
+    from iso639 import languages
+
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "language_codes.py")
+
+    with open(path, "w") as output:
+        output.write(header)
+        output.write("# ISO 639-1\n")
+        output.write(_table("alpha2_codes", languages.part1))
+        output.write("\n# ISO 639-2, bibliographic and terminology codes\n")
+        output.write(_table("alpha3_codes", set(languages.part2b) | set(languages.part2t)))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,404 @@
+import heapq
+import re
+
+# Every regular expression used while parsing is compiled once here at import time, so that the
+# hot paths do not go through the (bounded, shared) cache of the re module
+
+# user agent
+user_agent_separator_pattern = re.compile(r"[() ]")
+space_included_platform_pattern = re.compile(r"^[\s\w]+/[\d\.]+")
+bare_mozilla_pattern = re.compile(r"^Mozilla/[\.\d]+$")
+os_version_pattern = re.compile(r".*x\d+(_\d+)?.*")
+bot_url_pattern = re.compile(r"\+?https?://.+/.*")
+compatible_bot_prefix_pattern = re.compile(r"\(compatible;\s")
+compatible_bot_token_prefix_pattern = re.compile(r"compatible;\s")
+bot_link_prefix_pattern = re.compile(r"\(\+?https?://")
+http_scheme_pattern = re.compile(r"https?://")
+
+# names of well-known crawlers which do not always follow the (compatible; ...) or
+# (+https://...) conventions, matched regardless of case. Only crawler names, not vendor
+# names which are also found in browsers and apps (e.g. "YandexSearch/21.121")
+known_bot_tokens = (
+    "googlebot", "adsbot-google", "mediapartners-google", "storebot-google", "google-inspectiontool",
+    "bingbot", "bingpreview", "msnbot", "adidxbot", "slurp", "duckduckbot", "baiduspider",
+    "yandexbot", "yandeximages", "yandexvideo", "yandexmedia", "yandexnews", "yandexblogs",
+    "yandexmobilebot", "yandexmetrika", "yandexdirect", "yandexfavicons", "yandexwebmaster",
+    "yandexpagechecker", "yandexscreenshotbot", "yandexaccessibilitybot", "yandexrenderresourcesbot",
+    "yandexturbo", "yandexmarket", "yandexadnet", "yandexsitelinks", "yandexspravbot",
+    "sogou web spider", "sogou inst spider", "sogou pic spider", "sogou news spider",
+    "sogou video spider", "sogou orion spider", "sogou-test-spider", "exabot", "seznambot", "yeti/", "naverbot", "applebot", "petalbot", "bytespider",
+    "ahrefsbot", "semrushbot", "mj12bot", "dotbot", "rogerbot", "blexbot", "dataforseobot",
+    "serpstatbot", "screaming frog", "facebookexternalhit", "facebookcatalog", "meta-externalagent",
+    "twitterbot", "linkedinbot", "slackbot", "discordbot", "telegrambot", "whatsapp", "pinterestbot",
+    "redditbot", "embedly", "skypeuripreview", "ia_archiver", "archive.org_bot", "ccbot", "gptbot",
+    "amazonbot", "uptimerobot", "pingdom", "statuscake", "crawler", "spider",
+)
+
+
+def _token_trie_pattern(tokens, caseless=False):
+    # Builds one alternation whose branches share their common prefixes, so the regex engine
+    # walks the tokens like a trie at each position instead of trying every token in turn.
+    # With caseless, letters match in either case: the first one as separate literal branches,
+    # which keeps the quick scan of the re module for the possible first characters (searching
+    # with re.IGNORECASE does without it and is several times slower)
+    trie = {}
+    for token in tokens:
+        node = trie
+        for char in token:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node, first=False):
+        if "" in node:  # a shorter token already matches here
+            return ""
+
+        branches = []
+        for char, child in sorted(node.items()):
+            rest = build(child)
+            if not caseless or char.lower() == char.upper():
+                branches.append(re.escape(char) + rest)
+            elif first:
+                branches.append(re.escape(char.lower()) + rest)
+                branches.append(re.escape(char.upper()) + rest)
+            else:
+                branches.append("[%s%s]" % (re.escape(char.lower()), re.escape(char.upper())) + rest)
+
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    return build(trie, first=True)
+
+
+known_bot_pattern = re.compile(_token_trie_pattern(known_bot_tokens, caseless=True))
+
+# a product name made of literal (or escaped) characters followed by "/"
+literal_product_token_pattern = re.compile(r"\^?((?:[\w-]|\\[^\w\s])+/)")
+# a repeated group "(.+X)+" of a user agent pattern, see GapPattern
+repeated_gap_group_pattern = re.compile(r"(?<!\\)\(\.\+((?:\\.|[^\\()])+)\)\+")
+
+# url
+url_pattern = re.compile(r"\w+://.+/.*?")
+protocol_domain_pattern = re.compile(r"(\w*://)*([\[\]:@A-Za-z_0-9.-]+).*")
+fragment_pattern = re.compile(r"#[A-Za-z_0-9]+$")
+host_run_pattern = re.compile(r"[\[\]:@A-Za-z_0-9.-]+")
+# only tried at the start of a host-like run, so a long run without a port is scanned once
+host_port_pattern = re.compile(r"(?<![A-Za-z_0-9.-])[A-Za-z_0-9.-]+:\d+/?")
+port_pattern = re.compile(r":\d+")
+host_port_suffix_pattern = re.compile(r":\d+$")
+ipv6_host_pattern = re.compile(r"\[.+\]")
+ipv4_host_pattern = re.compile(r"\d+\.\d+\.\d+\.\d+")
+
+
+def has_product_slash(term):
+    # Same as re.match(r".+/.+", term): a "/" with at least one character on each side of it
+    end = term.find("\n")
+    if end == -1:
+        end = len(term)
+
+    return end > 2 and term.find("/", 1, end - 1) != -1
+
+
+def starts_with(term, prefix):
+    # Same as re.match(prefix + r".+", term) for a literal prefix
+    return term.startswith(prefix) and len(term) > len(prefix) and term[len(prefix)] != "\n"
+
+
+def _first_line(text):
+    # "." does not match a line break, so the scans below only look at the first line
+    end = text.find("\n")
+
+    return text if end == -1 else text[:end]
+
+
+def product_token_prefix(pattern):
+    # The literal product token a user agent pattern starts with, up to and including the first
+    # "/" (e.g. "Mozilla/" for r"Mozilla/.+\s\(.+\)"), or None when the pattern does not start
+    # with one. A user agent can then only match the pattern when the text before its own first
+    # "/" is that token
+    token = literal_product_token_pattern.match(pattern)
+    if token is None:
+        return None
+
+    return re.sub(r"\\(.)", r"\1", token.group(1))
+
+
+class _PieceSearch:
+    # re.search of a piece from positions which never decrease, scanning the text once: a
+    # search which found nothing, or a match at or after the next position, is not redone
+
+    __slots__ = ("piece", "text", "found", "searched")
+
+    def __init__(self, piece, text):
+        self.piece = piece
+        self.text = text
+        self.found = None
+        self.searched = False
+
+    def search(self, position):
+        if not self.searched or (self.found is not None and self.found.start() < position):
+            self.found = self.piece.search(self.text, position)
+            self.searched = True
+
+        return self.found
+
+
+def _gap_piece_ends(text, search, end, ends):
+    # Appends to ends where the piece of search can end after a ".+" gap from end: the earliest
+    # end, and then the earliest on each later line a piece matching a line break can reach.
+    # Returns whether the piece was found at all
+    line_end = text.find("\n", end)
+    if line_end == -1:
+        line_end = len(text)
+
+    position = end + 1  # a gap takes at least one character
+    found_any = False
+    while position <= line_end:
+        found = search.search(position)
+        if found is None or found.start() > line_end:
+            break
+        found_any = True
+        ends.append(found.end())
+
+        # a later start only helps when it ends on a later line
+        next_line = text.find("\n", found.end())
+        if next_line == -1:
+            break
+        position = max(found.start() + 1, next_line + 1 - (found.end() - found.start()))
+
+    return found_any
+
+
+def _earliest_per_line(text, ends):
+    # the earliest of the ends on each line, in order
+    earliest = []
+    line_end = -1
+    for end in sorted(ends):
+        if end > line_end:
+            earliest.append(end)
+            line_end = text.find("\n", end)
+            if line_end == -1:
+                line_end = len(text)
+
+    return earliest
+
+
+class GapPattern:
+    # A pattern made of fixed-width pieces joined by ".+" gaps, e.g. r"Mozilla/.+\s\(.+\)",
+    # matched from the start of the text like re.match. Each piece is searched once, leftmost
+    # first, which is all it takes to decide whether the gaps can be filled, so matching is
+    # linear in the length of the text whatever it contains. Only the last piece may have a
+    # variable width (e.g. r"/[\.\d]+$"), and a leading "^" is ignored. A repeated group
+    # "(.+X)+" of a fixed-width X is also allowed: on one line it is the same as ".+X", but it
+    # can go on to the next line when X matches a line break (e.g. ";\s")
+
+    __slots__ = ("pattern", "pieces", "hops")
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        if pattern.startswith("^"):
+            pattern = pattern[1:]
+
+        # hops maps the index of the piece after a repeated group to its X, which is also
+        # the start of that piece
+        pieces = []
+        self.hops = {}
+        parts = repeated_gap_group_pattern.split(pattern)
+        for index in range(0, len(parts), 2):
+            part = parts[index]
+            if index > 0:
+                self.hops[len(pieces)] = re.compile(parts[index - 1])
+                part = ".+" + parts[index - 1] + part
+            pieces.extend(part.split(".+")[1:] if index > 0 else part.split(".+"))
+        self.pieces = [re.compile(piece) for piece in pieces]
+
+    def match(self, text):
+        if "\n" in text:
+            return self._match_lines(text)
+
+        found = self.pieces[0].match(text)
+        if found is None:
+            return False
+
+        for piece in self.pieces[1:]:
+            position = found.end() + 1  # a gap takes at least one character
+            if position > len(text):
+                return False
+            found = piece.search(text, position)
+            if found is None:
+                return False
+
+        return True
+
+    def _match_lines(self, text):
+        # A gap stops at a line break but a piece may match one (e.g. "\s"), so the leftmost
+        # piece is not always the one to take: a later one ending on a further line leaves the
+        # gap after it a different line to fill. For each line only the earliest end of a piece
+        # matters, and the starts of the next piece are searched in increasing order, so each
+        # piece still scans the text once
+        found = self.pieces[0].match(text)
+        if found is None:
+            return False
+
+        ends = [found.end()]
+        last = len(self.pieces) - 1
+        for index in range(1, last + 1):
+            hop = self.hops.get(index)
+            if hop is not None:
+                ends = self._hop(text, hop, ends)
+
+            search = _PieceSearch(self.pieces[index], text)
+            next_ends = []
+            for end in ends:
+                if _gap_piece_ends(text, search, end, next_ends) and index == last:
+                    return True
+            if not next_ends:
+                return False
+
+            ends = _earliest_per_line(text, next_ends)
+
+        return False
+
+    def _hop(self, text, hop, ends):
+        # The lines a repeated group "(.+X)+" can leave its last repetition on, from ends: those
+        # of ends and of every ".+X" reached from them, earliest end on each line first
+        search = _PieceSearch(hop, text)
+        pending = list(ends)
+        heapq.heapify(pending)
+        reached = []
+        line_end = -1
+        while pending:
+            end = heapq.heappop(pending)
+            if end <= line_end:  # a line already reached from an earlier end
+                continue
+            reached.append(end)
+            line_end = text.find("\n", end)
+            if line_end == -1:
+                line_end = len(text)
+
+            further = []
+            _gap_piece_ends(text, search, end, further)
+            for other in further:
+                if other > line_end:
+                    heapq.heappush(pending, other)
+
+        return reached
+
+
+# The bot rules below give the same results as the regular expressions quoted in their comments,
+# but find each literal part once with a left-to-right scan
+# instead of backtracking over the ".+" gaps
+
+
+def _compatible_bot_rest(text, prefix, end):
+    # The rest of the compatible bot span after its prefix, within text[:end]
+    url = http_scheme_pattern.search(text, prefix.end() + 1, end)
+    if url is None:
+        return None
+    slash = text.find("/", url.end() + 1, end)
+    close = text.rfind(")", prefix.end(), end)
+    if slash == -1 or close <= slash:
+        return None
+
+    return prefix.start(), close + 1
+
+
+def compatible_bot_span(text):
+    # Span of re.search(r"\(compatible;\s.+https?://.+/.*\)", text). "." does not match a line
+    # break, so the span is in the first line which has one, except that "\s" may be the line
+    # break right after "(compatible;", the rest being on the next line
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end == -1:
+            end = len(text)
+
+        prefix = compatible_bot_prefix_pattern.search(text, start, end)
+        if prefix is not None:
+            span = _compatible_bot_rest(text, prefix, end)
+            if span is not None:
+                return span
+        if end == len(text):
+            return None
+
+        prefix = compatible_bot_prefix_pattern.match(text, max(start, end - 12), end + 1)
+        if prefix is not None:
+            next_end = text.find("\n", end + 1)
+            span = _compatible_bot_rest(text, prefix, len(text) if next_end == -1 else next_end)
+            if span is not None:
+                return span
+
+        start = end + 1
+
+
+def _bot_link_span(text, start, end):
+    # Span of re.search(r"\(\+?https?://.+/.*\)", text[start:end]) for a single line
+    link = bot_link_prefix_pattern.search(text, start, end)
+    if link is None:
+        return None
+    slash = text.find("/", link.end() + 1, end)
+    close = text.rfind(")", start, end)
+    if slash == -1 or close <= slash:
+        return None
+
+    return link.start(), close + 1
+
+
+def linked_bot_span(text):
+    # Span of re.search(r"\(\+?https?://.+/.*\)", text), when
+    # re.match(r".+/.+\s?\(\+?https?://.+/.*?\)", text) succeeds; the "\s?" may be the line
+    # break between the product and the link
+    first_end = text.find("\n")
+    if first_end == -1:
+        first_end = len(text)
+    product_slash = text.find("/", 1, first_end)
+    if product_slash == -1:
+        return None
+
+    link = bot_link_prefix_pattern.search(text, product_slash + 2, first_end)
+    if link is None or _bot_link_span(text, link.start(), first_end) is None:
+        # the link on the next line
+        if product_slash > first_end - 2 or first_end == len(text):
+            return None
+        second_end = text.find("\n", first_end + 1)
+        if second_end == -1:
+            second_end = len(text)
+        link = bot_link_prefix_pattern.match(text, first_end + 1, second_end)
+        if link is None or _bot_link_span(text, link.start(), second_end) is None:
+            return None
+
+    # the leftmost link of the text, in the first line which has one
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end == -1:
+            end = len(text)
+        span = _bot_link_span(text, start, end)
+        if span is not None:
+            return span
+        start = end + 1
+
+
+def is_compatible_bot_token(term):
+    # Same as re.match(r"compatible;\s.+https?://.+/.+", term), where the "\s" may be a line break
+    prefix = compatible_bot_token_prefix_pattern.match(term)
+    if prefix is None:
+        return False
+    end = term.find("\n", prefix.end())
+    if end == -1:
+        end = len(term)
+    url = http_scheme_pattern.search(term, prefix.end() + 1, end)
+    if url is None:
+        return False
+    slash = term.find("/", url.end() + 1, end)
+
+    return slash != -1 and slash < end - 1
+
+
+def is_query(text):
+    # Same as re.match(r".+\?.+=.+", text)
+    text = _first_line(text)
+    question_mark = text.find("?", 1)
+    if question_mark == -1:
+        return False
+    equals = text.find("=", question_mark + 2)
+
+    return equals != -1 and equals < len(text) - 1
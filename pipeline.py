@@ -0,0 +1,250 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from readers import MappedLineReader, read_lines
+from webelementsparsers import UserAgentParser, URLParser
+
+
+log_formats = ("combined", "user_agent")
+
+# host ident user [time] "request" status size "referrer" "user-agent"
+combined_log_pattern = re.compile(
+    r'(?P<host>\S+) \S+ (?P<user>\S+) \[(?P<time>[^\]]*)\] "(?P<request>[^"]*)" (?P<status>\S+) (?P<size>\S+)'
+    r'(?: "(?P<referrer>[^"]*)" "(?P<user_agent>[^"]*)")?')
+
+
+def _add_prefixed(record, prefix, flat_dictionary):
+    if flat_dictionary is None:
+        return
+
+    for key, value in flat_dictionary.items():
+        record[prefix + "." + key] = value
+
+
+def _split_combined_line(line):
+    matched = combined_log_pattern.match(line)
+    if matched is None:
+        return {"raw": line}, None, None
+
+    fields = matched.groupdict()
+    record = {
+        "host": fields["host"],
+        "user": fields["user"],
+        "time": fields["time"],
+        "status": fields["status"],
+        "size": fields["size"],
+    }
+
+    request = fields["request"].split(" ")
+    if len(request) == 3:
+        record["method"], record["request_target"], record["protocol_version"] = request
+    else:
+        record["request"] = fields["request"]
+
+    referrer = fields["referrer"] if fields["referrer"] not in (None, "", "-") else None
+    user_agent = fields["user_agent"] if fields["user_agent"] not in (None, "", "-") else None
+    if referrer is not None:
+        record["referrer"] = referrer
+    if user_agent is not None:
+        record["user_agent"] = user_agent
+
+    return record, referrer, user_agent
+
+
+def _add_parsed(record, prefix, parser, item):
+    # The failure of one malformed item must not stop the whole log: the record then gets the
+    # error under prefix + ".error" instead of the parsed fields
+    try:
+        flat_dictionary = parser._parse_item(item, True)
+    except Exception as error:
+        record[prefix + ".error"] = "%s: %s" % (type(error).__name__, error)
+        return
+
+    _add_prefixed(record, prefix, flat_dictionary)
+
+
+def parse_chunk(lines, log_format="combined"):
+    # Worker entry point: parses a list of log lines into flat records, keeping their order
+    user_agent_parser = UserAgentParser("")
+    url_parser = URLParser("")
+    records = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if log_format == "user_agent":
+            record, referrer, user_agent = {"user_agent": line}, None, line
+        else:
+            record, referrer, user_agent = _split_combined_line(line)
+
+        if user_agent is not None:
+            _add_parsed(record, "user_agent", user_agent_parser, user_agent)
+        if referrer is not None:
+            _add_parsed(record, "referrer", url_parser, referrer)
+
+        records.append(record)
+
+    return records
+
+
+def count_errors(records, counts):
+    # Passes the records through, counting in counts["records"] and counts["errors"] how many
+    # there were and how many had an item which could not be parsed
+    for record in records:
+        counts["records"] = counts.get("records", 0) + 1
+        if "user_agent.error" in record or "referrer.error" in record:
+            counts["errors"] = counts.get("errors", 0) + 1
+
+        yield record
+
+
+def _chunks(lines, chunk_size):
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if len(chunk) == 0:
+            return
+
+        yield chunk
+
+
+def parse_log(lines, log_format="combined", workers=None, chunk_size=10000):
+    # Parses an iterable of log lines across a process pool, yielding flat records in input order.
+    # Only a bounded number of chunks is in flight at once, so the input is never fully buffered
+    if log_format not in log_formats:
+        raise ValueError("unknown log format: %s" % log_format)
+
+    if workers == 1:
+        for chunk in _chunks(lines, chunk_size):
+            yield from parse_chunk(chunk, log_format)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        max_pending = workers * 2
+        pending = deque()
+        for chunk in _chunks(lines, chunk_size):
+            pending.append(executor.submit(parse_chunk, chunk, log_format))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+
+        while len(pending) > 0:
+            yield from pending.popleft().result()
+
+
+def parse_file_range(path, start, end, log_format="combined"):
+    # Worker entry point for one newline-aligned byte range of a log file
+    return parse_chunk(read_lines(path, start, end), log_format)
+
+
+def parse_log_path(path, log_format="combined", workers=None, chunk_bytes=4 * 1024 * 1024):
+    # Like parse_log, but the workers memory-map the file and read their own byte ranges,
+    # so only range offsets travel to the workers and the file is never loaded as a whole
+    if log_format not in log_formats:
+        raise ValueError("unknown log format: %s" % log_format)
+
+    with MappedLineReader(path) as reader:
+        if workers == 1:
+            for start, end in reader.ranges(chunk_bytes):
+                yield from parse_chunk(reader.iter_lines(start, end), log_format)
+            return
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            max_pending = workers * 2
+            pending = deque()
+            for start, end in reader.ranges(chunk_bytes):
+                pending.append(executor.submit(
+                    parse_file_range, path, start, end, log_format))
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+
+            while len(pending) > 0:
+                yield from pending.popleft().result()
+
+
+def write_jsonl(records, output):
+    for record in records:
+        output.write(json.dumps(record))
+        output.write("\n")
+
+
+def write_csv(records, output, columns=None):
+    # Without explicit columns the header is taken from the first record; keys that only
+    # appear in later records are dropped
+    records = iter(records)
+    first_record = next(records, None)
+    if first_record is None:
+        return
+
+    if columns is None:
+        columns = list(first_record.keys())
+
+    writer = csv.DictWriter(output, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerow(first_record)
+    for record in records:
+        writer.writerow(record)
+
+
+def write_records(records, output, output_format="jsonl", columns=None):
+    if output_format == "jsonl":
+        write_jsonl(records, output)
+    elif output_format == "csv":
+        write_csv(records, output, columns=columns)
+    else:
+        raise ValueError("unknown output format: %s" % output_format)
+
+
+def parse_log_file(path, output, log_format="combined", output_format="jsonl", workers=None, chunk_bytes=4 * 1024 * 1024, columns=None):
+    records = parse_log_path(path, log_format=log_format,
+                             workers=workers, chunk_bytes=chunk_bytes)
+    write_records(records, output, output_format, columns)
+
+
+def main(argv=None):
+    argument_parser = argparse.ArgumentParser(
+        description="Parse the user agents and referrers of an access log in parallel")
+    argument_parser.add_argument("path", help="log file to parse, '-' for stdin")
+    argument_parser.add_argument("-o", "--output", default="-",
+                                 help="output file, '-' for stdout")
+    argument_parser.add_argument("--log-format", choices=log_formats, default="combined",
+                                 help="combined log format or one user agent per line")
+    argument_parser.add_argument("--output-format", choices=("jsonl", "csv"), default="jsonl")
+    argument_parser.add_argument("--workers", type=int, default=None,
+                                 help="number of worker processes (default: number of CPUs)")
+    argument_parser.add_argument("--chunk-size", type=int, default=10000,
+                                 help="number of stdin lines sent to a worker at once")
+    argument_parser.add_argument("--chunk-bytes", type=int, default=4 * 1024 * 1024,
+                                 help="size of the file byte range read by a worker at once")
+    argument_parser.add_argument("--columns", default=None,
+                                 help="comma-separated CSV columns (default: keys of the first record)")
+    args = argument_parser.parse_args(argv)
+
+    columns = args.columns.split(",") if args.columns is not None else None
+    if args.path == "-":
+        records = parse_log(sys.stdin, log_format=args.log_format,
+                            workers=args.workers, chunk_size=args.chunk_size)
+    else:
+        records = parse_log_path(args.path, log_format=args.log_format,
+                                 workers=args.workers, chunk_bytes=args.chunk_bytes)
+
+    counts = {}
+    records = count_errors(records, counts)
+    if args.output == "-":
+        write_records(records, sys.stdout, args.output_format, columns)
+    else:
+        with open(args.output, "w", newline="") as output:
+            write_records(records, output, args.output_format, columns)
+
+    if counts.get("errors", 0) > 0:
+        sys.stderr.write("%d of %d lines could not be parsed, see their .error fields\n" % (
+            counts["errors"], counts["records"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import time
+
+# Opt-in instrumentation of the parse pipeline. Assign a StageProfiler to the profiler class
+# attribute of a parser class (e.g. UserAgentParser.profiler = StageProfiler()) to record the
+# cumulative time and number of calls of every parse stage, and which ua_patterns entry
+# classified each user agent. One profiler can be shared by several parser classes; set the
+# attribute back to None to stop recording
+
+
+class StageProfiler:
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stage_seconds = {}
+        self.stage_calls = {}
+        self.pattern_hits = {}
+
+    def record(self, parser, stage, started):
+        # Adds the time since started to (parser, stage) and returns the current clock reading,
+        # which is the start of the next stage
+        now = self.clock()
+        key = (parser, stage)
+        self.stage_seconds[key] = self.stage_seconds.get(key, 0.0) + (now - started)
+        self.stage_calls[key] = self.stage_calls.get(key, 0) + 1
+
+        return now
+
+    def hit(self, parser, index, label):
+        # index of the matching pattern, or None when no pattern matched
+        key = (parser, index, label)
+        self.pattern_hits[key] = self.pattern_hits.get(key, 0) + 1
+
+    def reset(self):
+        self.stage_seconds.clear()
+        self.stage_calls.clear()
+        self.pattern_hits.clear()
+
+    def as_dict(self):
+        stages = {}
+        for (parser, stage), seconds in self.stage_seconds.items():
+            calls = self.stage_calls[(parser, stage)]
+            stages.setdefault(parser, {})[stage] = {
+                "calls": calls,
+                "seconds": seconds,
+                "mean_us": seconds / calls * 1e6,
+            }
+
+        pattern_hits = {}
+        for (parser, index, label), count in self.pattern_hits.items():
+            pattern_hits.setdefault(parser, []).append(
+                {"pattern": index, "label": label, "hits": count})
+        for hits in pattern_hits.values():
+            hits.sort(key=lambda hit: (hit["pattern"] is None, hit["pattern"] or 0))
+
+        return {"stages": stages, "pattern_hits": pattern_hits}
+
+    def to_prometheus(self, prefix="webelementsparser"):
+        # Prometheus text exposition format, one counter per stage and per pattern
+        lines = [
+            "# HELP %s_stage_seconds_total Cumulative time spent in each parse stage." % prefix,
+            "# TYPE %s_stage_seconds_total counter" % prefix,
+        ]
+        for (parser, stage), seconds in sorted(self.stage_seconds.items()):
+            lines.append('%s_stage_seconds_total{parser="%s",stage="%s"} %.9f' % (prefix, parser, stage, seconds))
+
+        lines.append("# HELP %s_stage_calls_total Number of times each parse stage ran." % prefix)
+        lines.append("# TYPE %s_stage_calls_total counter" % prefix)
+        for (parser, stage), calls in sorted(self.stage_calls.items()):
+            lines.append('%s_stage_calls_total{parser="%s",stage="%s"} %d' % (prefix, parser, stage, calls))
+
+        lines.append("# HELP %s_pattern_hits_total Number of items classified by each pattern." % prefix)
+        lines.append("# TYPE %s_pattern_hits_total counter" % prefix)
+        for (parser, index, label), count in sorted(self.pattern_hits.items(), key=lambda item: (
+                item[0][0], item[0][1] is None, item[0][1] or 0)):
+            lines.append('%s_pattern_hits_total{parser="%s",pattern="%s",label="%s"} %d' % (
+                prefix, parser, "none" if index is None else index, "none" if label is None else label, count))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,94 @@
+import hashlib
+import os
+
+# Public Suffix List lookups for components.Domain. The rules are read from the snapshot of
+# https://publicsuffix.org/list/public_suffix_list.dat bundled next to this module (replace the
+# file with a newer copy to update them, nothing is fetched at run time) and compiled on first
+# use into a trie of the reversed labels, e.g. "co.uk" is trie["uk"]["co"], so that the suffix
+# of a host is found in one walk over its labels from the right
+
+list_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "public_suffix_list.dat")
+
+_RULE = None  # key of the nodes where a rule ends, True for exception rules
+_tries = {}
+_digests = {}
+
+
+def _rules(path):
+    # (rule, private) of every rule of the list, the ICANN section first
+    private = False
+    with open(path, encoding="utf-8") as rules:
+        for line in rules:
+            line = line.strip()
+            if line.startswith("//"):
+                if "===BEGIN PRIVATE DOMAINS===" in line:
+                    private = True
+                continue
+            if line:
+                yield line.split()[0].lower(), private
+
+
+def _add_rule(trie, rule):
+    node = trie
+    for label in reversed(rule.lstrip("!").split(".")):
+        node = node.setdefault(label, {})
+    node[_RULE] = rule.startswith("!")
+
+
+def build_trie(path=list_path, include_private=False):
+    trie = {}
+    for rule, private in _rules(path):
+        if private and not include_private:
+            continue
+
+        _add_rule(trie, rule)
+        if not rule.isascii():  # hosts may also be written in punycode
+            try:
+                _add_rule(trie, rule.encode("idna").decode("ascii"))
+            except UnicodeError:
+                pass
+
+    return trie
+
+
+def list_digest(path=list_path):
+    # identifies the bundled list, e.g. in UserAgentParser.rules_version()
+    digest = _digests.get(path)
+    if digest is None:
+        with open(path, "rb") as rules:
+            digest = _digests[path] = hashlib.sha256(rules.read()).hexdigest()
+
+    return digest
+
+
+def suffix_trie(include_private=False):
+    # built once per process
+    trie = _tries.get(include_private)
+    if trie is None:
+        trie = _tries[include_private] = build_trie(include_private=include_private)
+
+    return trie
+
+
+def suffix_length(labels, include_private=False):
+    # Number of trailing labels which make the public suffix of a host split on ".": the longest
+    # matching rule, an exception rule ("!www.ck") removing the leftmost label of its match, and
+    # the implicit rule "*" making any unlisted top level domain a suffix
+    node = suffix_trie(include_private)
+    length = 1
+    for depth, label in enumerate(reversed(labels), 1):
+        wildcard = node.get("*")
+        if wildcard is not None and _RULE in wildcard:
+            length = depth
+
+        node = node.get(label.lower())
+        if node is None:
+            break
+
+        exception = node.get(_RULE)
+        if exception is not None:
+            if exception:
+                return depth - 1
+            length = depth
+
+    return length
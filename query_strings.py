@@ -0,0 +1,190 @@
+from urllib.parse import unquote_plus
+
+# Query string parsing for components.Query. A QueryString records where each key and value
+# starts and ends in the original text rather than copying them out, and percent-decodes a
+# key or value only when it is read, so that picking a few parameters (e.g. utm_source or
+# gclid) out of a long tracking url costs little more than finding them
+
+
+def decode(text):
+    if "%" in text or "+" in text:
+        return unquote_plus(text)
+    return text
+
+
+class QueryString:
+    # Multi-value mapping of the parameters of "key=value&key=value..." text (";" separated
+    # when there is no "&"). A parameter without "=" has the empty value, and a value keeps any
+    # further "=". get() and [] give the first value of a key, get_all() all of them in order.
+    # With keys, only the parameters with one of those (decoded) keys are recorded; with
+    # stop_early as well, the scan ends once each of them has been found, so that only their
+    # first values are recorded
+
+    __slots__ = ("text", "selected_keys", "stop_early", "_pairs", "_positions")
+
+    def __init__(self, text, keys=None, stop_early=False):
+        self.text = text
+        self.selected_keys = keys
+        self.stop_early = stop_early
+        self._pairs = None
+        self._positions = None
+
+    @property
+    def pairs(self):
+        # (key start, key end, value start, value end) in text of every recorded parameter,
+        # found on the first access
+        pairs = self._pairs
+        if pairs is None:
+            pairs = self._pairs = self._scan()
+
+        return pairs
+
+    def _separator(self):
+        return "&" if "&" in self.text else ";"
+
+    def _scan(self):
+        keys = self.selected_keys
+        separator = self._separator()
+        if keys is not None and "%" not in self.text and "+" not in self.text and \
+                all(key and "=" not in key and separator not in key for key in keys):
+            return self._find_keys(separator)
+
+        # walks the separators in place; with keys, a key is only copied out of text when it
+        # needs decoding or has the length of one of them
+        text = self.text
+        if keys is not None:
+            key_lengths = set(len(key) for key in keys)
+        missing = set(keys) if keys is not None and self.stop_early else None
+        pairs = []
+        length = len(text)
+        start = 0
+        while start < length:
+            end = text.find(separator, start)
+            if end == -1:
+                end = length
+            if end == start:
+                start = end + 1
+                continue
+
+            equals = text.find("=", start, end)
+            key_end = end if equals == -1 else equals
+            if keys is not None:
+                if text.find("%", start, key_end) == -1 and text.find("+", start, key_end) == -1:
+                    if key_end - start not in key_lengths:
+                        start = end + 1
+                        continue
+                    key = text[start:key_end]
+                else:
+                    key = unquote_plus(text[start:key_end])
+                if key not in keys or (missing is not None and key not in missing):
+                    start = end + 1
+                    continue
+
+            if equals == -1:
+                pairs.append((start, end, end, end))
+            else:
+                pairs.append((start, equals, equals + 1, end))
+
+            if missing is not None:
+                missing.discard(key)
+                if not missing:
+                    break
+
+            start = end + 1
+
+        return pairs
+
+    def _find_keys(self, separator):
+        # Same pairs as the walk of _scan when no key needs decoding: every parameter starts
+        # the text or follows a separator, so each key is looked for there with str.find and
+        # the other parameters are not visited at all
+        text = self.text
+        length = len(text)
+        pairs = []
+        for key in self.selected_keys:
+            marker = separator + key
+            start = 0 if text.startswith(key) else text.find(marker)
+            while start != -1:
+                if text[start] == separator:
+                    start += 1
+                key_end = start + len(key)
+                if key_end == length or text[key_end] == separator:
+                    pairs.append((start, key_end, key_end, key_end))
+                elif text[key_end] == "=":
+                    end = text.find(separator, key_end)
+                    pairs.append((start, key_end, key_end + 1, length if end == -1 else end))
+                else:  # a longer key starting with this one
+                    start = text.find(marker, key_end)
+                    continue
+
+                if self.stop_early:
+                    break
+                start = text.find(marker, key_end)
+
+        pairs.sort()
+        return pairs
+
+    def _key_positions(self):
+        # decoded key -> indexes of its pairs, built on the first lookup
+        positions = self._positions
+        if positions is None:
+            positions = self._positions = {}
+            text = self.text
+            for index, (key_start, key_end, _, _) in enumerate(self.pairs):
+                key = text[key_start:key_end]
+                if "%" in key or "+" in key:
+                    key = unquote_plus(key)
+                if key in positions:
+                    positions[key].append(index)
+                else:
+                    positions[key] = [index]
+
+        return positions
+
+    def _value(self, index, raw=False):
+        _, _, value_start, value_end = self.pairs[index]
+        value = self.text[value_start:value_end]
+        return value if raw else decode(value)
+
+    def get(self, key, default=None, raw=False):
+        indexes = self._key_positions().get(key)
+        if indexes is None:
+            return default
+        return self._value(indexes[0], raw)
+
+    def get_all(self, key, raw=False):
+        return [self._value(index, raw) for index in self._key_positions().get(key, ())]
+
+    def __getitem__(self, key):
+        indexes = self._key_positions().get(key)
+        if indexes is None:
+            raise KeyError(key)
+        return self._value(indexes[0])
+
+    def __contains__(self, key):
+        return key in self._key_positions()
+
+    def __iter__(self):
+        return iter(self._key_positions())
+
+    def __len__(self):
+        return len(self._key_positions())
+
+    def keys(self):
+        return self._key_positions().keys()
+
+    def items(self, raw=False):
+        # every (key, value) pair in order, repeated keys included
+        text = self.text
+        for key_start, key_end, value_start, value_end in self.pairs:
+            key = text[key_start:key_end]
+            value = text[value_start:value_end]
+            yield (key, value) if raw else (decode(key), decode(value))
+
+    def as_dict(self, raw=False):
+        # the last value of every key
+        if raw and self.selected_keys is None and self._pairs is None:
+            # nothing to skip or decode, split the text rather than record the positions
+            return dict(part.partition("=")[::2] for part in self.text.split(self._separator()) if part)
+
+        return dict(self.items(raw))
@@ -0,0 +1,80 @@
+import mmap
+import os
+
+
+class MappedLineReader:
+    # Reads a log file through a memory map, decoding one line at a time, so resident memory does
+    # not grow with the size of the file. The file can be split into newline-aligned byte ranges
+    # which separate workers read independently
+
+    def __init__(self, path, encoding="utf-8", errors="replace"):
+        self.path = path
+        self.encoding = encoding
+        self.errors = errors
+        self.size = os.path.getsize(path)
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size > 0 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_lines()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _next_boundary(self, position):
+        # first line start at or after position
+        if position <= 0:
+            return 0
+        if position >= self.size:
+            return self.size
+
+        newline = self._map.find(b"\n", position - 1)
+
+        return self.size if newline == -1 else newline + 1
+
+    def ranges(self, chunk_bytes):
+        # Yields (start, end) byte ranges of roughly chunk_bytes each, ending on line boundaries
+        start = 0
+        while start < self.size:
+            end = self._next_boundary(start + max(chunk_bytes, 1))
+            yield start, end
+            start = end
+
+    def shards(self, count):
+        # Splits the file into at most count newline-aligned byte ranges of similar size
+        boundaries = [self._next_boundary(self.size * idx // count)
+                      for idx in range(count)] + [self.size]
+
+        return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+    def iter_lines(self, start=0, end=None):
+        # Yields the decoded lines in [start, end) without their line terminator
+        if self._map is None:
+            return
+
+        end = self.size if end is None else end
+        find = self._map.find
+        position = start
+        while position < end:
+            newline = find(b"\n", position, end)
+            if newline == -1:
+                newline = end
+            line = self._map[position:newline]
+            if line[-1:] == b"\r":
+                line = line[:-1]
+            yield line.decode(self.encoding, self.errors)
+            position = newline + 1
+
+
+def read_lines(path, start=0, end=None, encoding="utf-8", errors="replace"):
+    with MappedLineReader(path, encoding=encoding, errors=errors) as reader:
+        yield from reader.iter_lines(start, end)
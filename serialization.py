@@ -0,0 +1,300 @@
+import struct
+from collections.abc import Mapping
+from components import Product, Device, OS, Browser, Bot, Domain, Subdirectories, Query
+
+# Compact binary encoding of parse results (the dictionaries of components_as_dictionary() or
+# components_as_flat_dictionary(), frozen or not). Every value starts with a one-byte tag:
+# integers are zigzag varints, a string is written once and then referred to by its index in
+# the string table (in one byte for the first strings), and a dictionary is the index of its
+# shape (its keys, in order) followed by its values. The shapes of the components are
+# predefined from their flat_fields, so component dictionaries carry no keys at all; other
+# shapes are written once, like strings. Lists and tuples decode as lists.
+#
+# A frame is the varint length of its payload, then the format version, the varint number of
+# values and the values, which share the string and shape tables of the frame; frames are
+# independent of each other, so a stream of frames can be cut at any frame boundary
+
+format_version = 1
+
+# ids of the predefined shapes; only append to this, and bump format_version when a component
+# changes its fields
+schema_components = (Product, Device, OS, Browser, Bot, Domain, Subdirectories, Query)
+schema_shapes = tuple(component.flat_fields for component in schema_components)
+
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+_INT = 3
+_FLOAT = 4
+_STRING = 5
+_STRING_REFERENCE = 6
+_LIST = 7
+_SHAPE = 8
+_NEW_SHAPE = 9
+_SMALL_REFERENCE = 16  # tags from 16 on are references to the strings 0 to 239
+_small_references = 256 - _SMALL_REFERENCE
+
+_double = struct.Struct("<d")
+
+
+def _write_varint(buffer, number):
+    while number > 0x7f:
+        buffer.append((number & 0x7f) | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+
+class Encoder:
+    # Appends values to buffer, sharing the string and shape tables between them
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.strings = {}
+        self.shapes = dict((shape, index) for index, shape in enumerate(schema_shapes))
+
+    def encode(self, value):
+        buffer = self.buffer
+        kind = type(value)
+        if kind is str:
+            strings = self.strings
+            index = strings.get(value)
+            if index is None:
+                strings[value] = len(strings)
+                data = value.encode("utf-8", "surrogatepass")
+                buffer.append(_STRING)
+                _write_varint(buffer, len(data))
+                buffer += data
+            elif index < _small_references:
+                buffer.append(_SMALL_REFERENCE + index)
+            else:
+                buffer.append(_STRING_REFERENCE)
+                _write_varint(buffer, index)
+        elif value is None:
+            buffer.append(_NONE)
+        elif kind is bool:
+            buffer.append(_TRUE if value else _FALSE)
+        elif kind is int:
+            buffer.append(_INT)
+            _write_varint(buffer, value << 1 if value >= 0 else (-value << 1) - 1)
+        elif kind is float:
+            buffer.append(_FLOAT)
+            buffer += _double.pack(value)
+        elif isinstance(value, Mapping):
+            keys = tuple(value)
+            shape = self.shapes.get(keys)
+            if shape is None:
+                self.shapes[keys] = len(self.shapes)
+                buffer.append(_NEW_SHAPE)
+                _write_varint(buffer, len(keys))
+                for key in keys:
+                    self.encode(key)
+            else:
+                buffer.append(_SHAPE)
+                _write_varint(buffer, shape)
+
+            for item in value.values():
+                self.encode(item)
+        elif isinstance(value, (list, tuple)):
+            buffer.append(_LIST)
+            _write_varint(buffer, len(value))
+            for item in value:
+                self.encode(item)
+        else:
+            raise TypeError("cannot encode a value of type %s" % kind.__name__)
+
+
+class Decoder:
+    # Reads the values written by an Encoder from data, starting at offset
+
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+        self.strings = []
+        self.shapes = list(schema_shapes)
+
+    def _read_varint(self):
+        data = self.data
+        offset = self.offset
+        number = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            number |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                self.offset = offset
+                return number
+            shift += 7
+
+    def _invalid(self, kind, index):
+        # a reference past the tables read so far is corrupted data, not truncated data (which
+        # is an IndexError while reading)
+        return ValueError("invalid %s %d at offset %d" % (kind, index, self.offset))
+
+    def decode(self):
+        tag = self.data[self.offset]
+        self.offset += 1
+        if tag >= _SMALL_REFERENCE:
+            try:
+                return self.strings[tag - _SMALL_REFERENCE]
+            except IndexError:
+                raise self._invalid("string reference", tag - _SMALL_REFERENCE)
+        elif tag == _SHAPE:
+            index = self._read_varint()
+            try:
+                keys = self.shapes[index]
+            except IndexError:
+                raise self._invalid("shape", index)
+            return dict(zip(keys, [self.decode() for _ in keys]))
+        elif tag == _STRING:
+            length = self._read_varint()
+            end = self.offset + length
+            if end > len(self.data):
+                raise IndexError("string past the end of the data")
+            value = bytes(self.data[self.offset:end]).decode("utf-8", "surrogatepass")
+            self.offset = end
+            self.strings.append(value)
+            return value
+        elif tag == _NONE:
+            return None
+        elif tag == _LIST:
+            return [self.decode() for _ in range(self._read_varint())]
+        elif tag == _INT:
+            number = self._read_varint()
+            return -((number + 1) >> 1) if number & 1 else number >> 1
+        elif tag == _FALSE:
+            return False
+        elif tag == _TRUE:
+            return True
+        elif tag == _STRING_REFERENCE:
+            index = self._read_varint()
+            try:
+                return self.strings[index]
+            except IndexError:
+                raise self._invalid("string reference", index)
+        elif tag == _NEW_SHAPE:
+            keys = tuple(self.decode() for _ in range(self._read_varint()))
+            self.shapes.append(keys)
+            return dict(zip(keys, [self.decode() for _ in keys]))
+        elif tag == _FLOAT:
+            value = _double.unpack_from(self.data, self.offset)[0]
+            self.offset += _double.size
+            return value
+
+        raise ValueError("unknown tag %d at offset %d" % (tag, self.offset - 1))
+
+
+def _check_version(version):
+    if version != format_version:
+        raise ValueError("unsupported format version %d" % version)
+
+
+def dumps(value):
+    # A single value with its own tables
+    encoder = Encoder()
+    encoder.buffer.append(format_version)
+    encoder.encode(value)
+
+    return bytes(encoder.buffer)
+
+
+def loads(data):
+    try:
+        _check_version(data[0])
+        decoder = Decoder(data, 1)
+        value = decoder.decode()
+    except IndexError:
+        raise ValueError("truncated data")
+
+    if decoder.offset != len(data):
+        raise ValueError("%d bytes after the value" % (len(data) - decoder.offset))
+
+    return value
+
+
+def encode_frame(values):
+    encoder = Encoder()
+    count = 0
+    for value in values:
+        encoder.encode(value)
+        count += 1
+
+    header = bytearray()
+    payload_header = bytearray([format_version])
+    _write_varint(payload_header, count)
+    _write_varint(header, len(payload_header) + len(encoder.buffer))
+
+    return bytes(header + payload_header + encoder.buffer)
+
+
+def _decode_payload(payload):
+    try:
+        _check_version(payload[0])
+        decoder = Decoder(payload, 1)
+        values = [decoder.decode() for _ in range(decoder._read_varint())]
+    except IndexError:
+        raise ValueError("truncated frame")
+
+    if decoder.offset != len(payload):
+        raise ValueError("%d bytes after the values of the frame" % (len(payload) - decoder.offset))
+
+    return values
+
+
+def decode_frames(data):
+    # Yields the values of the frames in a bytes-like object
+    data = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        decoder = Decoder(data, offset)
+        try:
+            length = decoder._read_varint()
+        except IndexError:
+            raise ValueError("truncated frame")
+        offset = decoder.offset + length
+        if offset > len(data):
+            raise ValueError("truncated frame")
+
+        yield from _decode_payload(data[decoder.offset:offset])
+
+
+def write_frames(values, output, frame_size=1000):
+    # Writes the values to a binary file object in frames of up to frame_size values; returns
+    # the number of values written
+    batch = []
+    count = 0
+    for value in values:
+        batch.append(value)
+        if len(batch) >= frame_size:
+            output.write(encode_frame(batch))
+            count += len(batch)
+            batch = []
+
+    if len(batch) > 0:
+        output.write(encode_frame(batch))
+        count += len(batch)
+
+    return count
+
+
+def read_frames(input):
+    # Yields the values of the frames read from a binary file object, one frame at a time
+    while True:
+        length = 0
+        shift = 0
+        while True:
+            byte = input.read(1)
+            if len(byte) == 0:
+                if shift == 0:
+                    return
+                raise ValueError("truncated frame")
+            length |= (byte[0] & 0x7f) << shift
+            if byte[0] < 0x80:
+                break
+            shift += 7
+
+        payload = input.read(length)
+        if len(payload) < length:
+            raise ValueError("truncated frame")
+
+        yield from _decode_payload(payload)
@@ -1,389 +1,403 @@
-import re
-from components import Product, OS, Browser, Bot, Device, Domain, Subdirectories, Query
-import copy
+from components import Component, Product, Bot, Domain, Subdirectories, Query, flatten
+from caching import freeze
+import hashlib
+import extractors
+import patterns
+import public_suffixes
+
+_MISSING = object()
+
+
+def _canonical_text(value):
+    # repr of value which does not depend on the iteration order of sets, see rules_version()
+    if isinstance(value, (set, frozenset)):
+        return "{%s}" % ", ".join(sorted(_canonical_text(item) for item in value))
+    elif isinstance(value, dict):
+        return "{%s}" % ", ".join("%s: %s" % (_canonical_text(key), _canonical_text(item))
+                                  for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        return "[%s]" % ", ".join(_canonical_text(item) for item in value)
+
+    return repr(value)
+
+
+def compile_patterns(ua_patterns):
+    # Compiles an ordered list of (label, pattern) pairs into linear-time matchers; the label of
+    # the first matching pattern is the classification
+    return [(label, patterns.GapPattern(pattern)) for label, pattern in ua_patterns]
+
+
+def build_dispatch(classifier):
+    # Indexes compiled patterns on the product token they start with (e.g. "Mozilla/"). Returns a
+    # dictionary from product token to the indices of the patterns a user agent starting with
+    # that token can match, and the indices of the patterns which do not start with a fixed
+    # token (tried for every user agent), both in the original order
+    prefixes = [patterns.product_token_prefix(pattern.pattern) for _, pattern in classifier]
+    fallback = tuple(index for index, prefix in enumerate(prefixes) if prefix is None)
+
+    dispatch = {}
+    for prefix in prefixes:
+        if prefix is not None and prefix not in dispatch:
+            dispatch[prefix] = tuple(index for index, other in enumerate(prefixes)
+                                     if other is None or other == prefix)
+
+    return dispatch, fallback
+
+
+class _ClassAttributeAlias:
+    # Reads another attribute of the class, from the class or its instances; kept for names
+    # which have been replaced, so that reading them keeps working
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        return getattr(owner, self.name)
+
+
+def tokenize_user_agent(user_agent):
+    # Splits a user agent into its space separated tokens, keeping each parenthesised group
+    # (spaces included) as a single token
+    tokens = []
+    start = 0
+    inside_parentheses = False
+    for separator in patterns.user_agent_separator_pattern.finditer(user_agent):
+        char = separator.group()
+        if char == " " and inside_parentheses:
+            continue
+
+        position = separator.start()
+        if position > start:
+            tokens.append(user_agent[start:position])
+        start = position + 1
+
+        if char == "(":
+            inside_parentheses = True
+        elif char == ")":
+            inside_parentheses = False
+
+    if start < len(user_agent):
+        tokens.append(user_agent[start:])
+
+    return tokens
+
+
+def is_bot(user_agent):
+    # Tells whether a user agent belongs to a bot without parsing it: the (compatible; ...) and
+    # (+https://...) rules of UserAgentParser plus a list of well-known crawler names
+    return (patterns.known_bot_pattern.search(user_agent) is not None
+            or patterns.compatible_bot_span(user_agent) is not None
+            or patterns.linked_bot_span(user_agent) is not None)
 
 
 class Parser:
 
-    def parse(self):
-        pass
+    __slots__ = ()
+    flat_raw_keys = ()
+
+    # optional profiling.StageProfiler recording the time spent in each stage of parse(), and the
+    # name the stages are recorded under
+    profiler = None
+    profiler_name = None
+
+    @classmethod
+    def parse_many(cls, items, flat=False, cache=None, fields=None):
+        # Lazily parses a stream of raw strings with one reused parser object, yielding the
+        # dictionary (or flat dictionary) of each item, or None when it cannot be parsed.
+        # With a cache (e.g. caching.LRUCache) the results are frozen and shared between hits.
+        # fields restricts the result to the given top-level keys, see parse()
+        fields = frozenset(fields) if fields is not None else None
+        parser = cls("")
+        for item in items:
+            if cache is None:
+                yield parser._parse_item(item, flat, fields)
+                continue
+
+            key = (cls, item, flat, fields)
+            result = cache.get(key, _MISSING)
+            if result is _MISSING:
+                result = freeze(parser._parse_item(item, flat, fields))
+                cache.put(key, result)
+
+            yield result
+
+    @classmethod
+    def parse_cached(cls, item, cache, flat=False, fields=None):
+        return next(cls.parse_many((item,), flat=flat, cache=cache, fields=fields))
+
+    def _parse_item(self, item, flat, fields=None):
+        self._reset(item)
+        if self.parse(fields) is None:
+            return None
+        elif flat:
+            return self.components_as_flat_dictionary()
+
+        return self.components_as_dictionary()
 
     def components_as_dictionary(self):
-        pass
+        profiler = self.profiler
+        if profiler is not None:
+            started = profiler.clock()
+
+        dictionary = dict((key, value.get_as_dict() if isinstance(value, Component) else value)
+                          for key, value in self._selected_items())
+
+        if profiler is not None:
+            profiler.record(self.profiler_name, "as_dictionary", started)
+
+        return dictionary
 
     def components_as_flat_dictionary(self):
+        profiler = self.profiler
+        if profiler is not None:
+            started = profiler.clock()
+
+        flat_dictionary = flatten(dict(self._selected_items()).items(), self.flat_raw_keys)
+
+        if profiler is not None:
+            profiler.record(self.profiler_name, "as_flat_dictionary", started)
+
+        return flat_dictionary
+
+    @classmethod
+    def rules_tables(cls):
+        # the tables and settings which decide the results of the class
+        return []
+
+    @classmethod
+    def rules_version(cls):
+        # Digest of rules_tables(), which changes with any of them; results stored under one
+        # version (see caching.SQLiteCache) are not returned by parsers of another
+        text = "%s.%s\n%s" % (cls.__module__, cls.__qualname__, _canonical_text(cls.rules_tables()))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+    def parse(self, fields=None):
+        pass
+
+    def _component_items(self):
+        # (key, value) pairs of the result; a repeated key keeps the position of its first
+        # occurrence and the value of its last one
+        return []
+
+    def _selected_items(self):
+        if self.fields is None:
+            return self._component_items()
+
+        return [(key, value) for key, value in self._component_items() if key in self.fields]
+
+    def _reset(self, item):
         pass
 
 
 class UserAgentParser(Parser):
 
-    ua_patterns = [  # User-agent patterns can be found on https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/User-Agent
+    # User-agent patterns can be found on https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/User-Agent
+    # Each pattern is a sequence of fixed-width pieces joined by ".+" or "(.+X)+" groups (see
+    # patterns.GapPattern) so that no input can make the matching backtrack; optional parts are
+    # spelled out as separate patterns with the same label
+    ua_patterns = [
         ("firefox", r"Mozilla/.+\s\((.+;\s)+rv:.+\)\sGecko/.+\sFirefox/.+"),
         ("firefox", r"Mozilla/.+\s\((.+;\s)+rv:.+\).+"),
         ("opera", r"Mozilla/.+\s\(.+\)\sAppleWebKit/.+\s\(KHTML,\slike\sGecko\)\sChrome/.+\sSafari/.+\sOPR/.+"),
         ("chrome", r"Mozilla/.+\s\(.+\)\sAppleWebKit/.+\s\(KHTML,\slike\sGecko\)\sChrome/.+\sSafari/.+"),
-        ("safari", r"Mozilla/.+\s\(.+\)\sAppleWebKit/.+\s\(KHTML,\slike\sGecko\)\s(Version/.+\s)?(Mobile/.+\s)?Safari/.+"),
+        ("safari", r"Mozilla/.+\s\(.+\)\sAppleWebKit/.+\s\(KHTML,\slike\sGecko\)\sSafari/.+"),
+        ("safari", r"Mozilla/.+\s\(.+\)\sAppleWebKit/.+\s\(KHTML,\slike\sGecko\)\sVersion/.+\sSafari/.+"),
+        ("safari", r"Mozilla/.+\s\(.+\)\sAppleWebKit/.+\s\(KHTML,\slike\sGecko\)\sMobile/.+\sSafari/.+"),
+        ("safari", r"Mozilla/.+\s\(.+\)\sAppleWebKit/.+\s\(KHTML,\slike\sGecko\)\sVersion/.+\sMobile/.+\sSafari/.+"),
         ("safari", r"Safari/.+\(.+\)"),
-        ("safari", r"MobileSafari/.+(\s.+/.+)*"),
+        ("safari", r"MobileSafari/.+"),
         ("ie", r"Mozilla/.+\s\(.+MSIE.+\)"),
         ("browserless", r"Mozilla/.+\s\(.+\)\sAppleWebKit/.+\s\(KHTML,\slike\sGecko\)"),
-        ("browserless", r"curl/.+(\s\(.+\).+)?"),
+        ("browserless", r"curl/.+"),
         ("browserless", r"^.+/[\.\d]+$"),
         ("browserless", r"com\.apple\.WebKit\.WebContent/.+")
     ]
 
-    devices_list = ["WOW64", "WOW", "iPhone", "iPad", "iPod", "Macintosh",
-                    "Linux", "X11", "Win64", "Maemo", "Mobile", "Tablet"]
+    ua_classifier = compile_patterns(ua_patterns)
+    ua_dispatch, ua_fallback = build_dispatch(ua_classifier)
+
+    # How the details are extracted from each kind of user agent, see extractors.py:
+    # (classification, leading product token or None for any, extractor kind, options)
+    detail_rules = [
+        ("firefox", None, "platform", {
+            "browser_token": "Firefox", "browser_choice": "single", "excluded": ("Firefox",),
+            "compatibility_from": 2, "gecko_release_version": True, "layout_engine": False, "os_first": False}),
+        ("chrome", None, "platform", {"browser_token": "Chrome", "excluded": ("Chrome",)}),
+        ("opera", None, "platform", {"browser_token": "OPR", "excluded": ("OPR",)}),
+        ("safari", "Mozilla/", "platform", {
+            "browser_token": "Safari", "version_token": "Version", "device_build_token": "Mobile",
+            "excluded": ("Safari", "Version", "Mobile")}),
+        ("safari", "Safari/", "product_list", {"browser": "Safari/", "os_name": "macOS", "os_from": "leftover"}),
+        ("safari", "MobileSafari/", "product_list", {"browser": "Safari/", "os_name": "macOS"}),
+        ("ie", None, "ie", {}),
+        ("browserless", "Mozilla/", "platform", {
+            "device_build_token": "Mobile", "excluded": ("Mobile",), "skip_bare_mozilla": True}),
+        ("browserless", "curl/", "product_list", {"compatibility_from": 2, "os_from": "token"}),
+        ("browserless", "com.apple.WebKit.WebContent/", "product_list", {"os_name": "macOS", "os_from": "leftover"}),
+    ]
+
+    detail_handlers = extractors.compile_detail_rules(detail_rules)
+
+    profiler_name = "user_agent"
+
+    # result keys which need the tokens inside the parentheses to be extracted
+    detail_fields = frozenset(
+        ("browser", "os", "device", "layout_browser_engine"))
+
+    # longer user agents are not parsed; parse() returns None and sets truncated
+    max_length = 4096
+
+    __slots__ = ("user_agent", "raw_components", "components", "browser",
+                 "bot_status", "layout_browser_engine", "fields", "truncated")
+
+    # platform terms which name the device rather than the OS; extend with register_devices()
+    devices = frozenset(["WOW64", "WOW", "iPhone", "iPad", "iPod", "Macintosh",
+                         "Linux", "X11", "Win64", "Maemo", "Mobile", "Tablet"])
+    # the former list of devices, now read-only: use register_devices() to add to it
+    devices_list = _ClassAttributeAlias("devices")
+
+    @classmethod
+    def rules_tables(cls):
+        # the target links of bots are parsed by URLParser
+        return [cls.ua_patterns, cls.detail_rules, cls.devices, cls.max_length] + URLParser.rules_tables()
+
+    @classmethod
+    def register_devices(cls, names):
+        # Adds device names (e.g. phone models) to the vocabulary of this class and its subclasses;
+        # lookups stay constant-time however many are registered
+        cls.devices = cls.devices | frozenset(names)
 
     def __init__(self, user_agent):
-        self.user_agent = user_agent
         self.raw_components = []
         self.components = []
+        self._reset(user_agent)
+
+    def _reset(self, user_agent):
+        self.user_agent = user_agent
+        self.raw_components.clear()
+        self.components.clear()
         self.browser = None
         self.bot_status = False
         self.layout_browser_engine = None
+        self.fields = None
+        self.truncated = False
 
-    def components_as_dictionary(self):
-        components_list = []
-        for component in self.components:
-            components_list.append(
-                (component.component_type, component.get_as_dict()))
+    def _component_items(self):
+        components_list = [(component.component_type, component)
+                           for component in self.components]
 
         if self.layout_browser_engine is not None:
             components_list.append(
-                ("layout_browser_engine", self.layout_browser_engine.get_as_dict()))
+                ("layout_browser_engine", self.layout_browser_engine))
         components_list.append(("is_bot", self.bot_status))
 
-        return dict(components_list)
+        return components_list
 
-    def components_as_flat_dictionary(self):
-        flat_dictionary = {}
-        components_dict = self.components_as_dictionary()
-        self._mine_dictionary("", components_dict, flat_dictionary)
+    def parse(self, fields=None):
+        # fields optionally names the top-level keys the caller needs ("product", "browser", "os",
+        # "device", "layout_browser_engine", "bot", "is_bot"); the classification (self.browser,
+        # self.bot_status) is always done, but the token extraction only when a key needs it
+        self.fields = frozenset(fields) if fields is not None else None
+        if self.max_length is not None and len(self.user_agent) > self.max_length:
+            self.truncated = True
+            return None
 
-        return flat_dictionary
+        profiler = self.profiler
+        if profiler is not None:
+            started = profiler.clock()
 
-    def parse(self):
         self._preprocess_user_agent()
+        if profiler is not None:
+            started = profiler.record(self.profiler_name, "preprocess", started)
+
         self._check_bot()
+        if profiler is not None:
+            started = profiler.record(self.profiler_name, "check_bot", started)
 
-        for ua_pattern in self.ua_patterns:
-            if bool(re.match(ua_pattern[1], self.user_agent)):
-                self.browser = ua_pattern[0]
-                break
+        pattern_index = self._classify()
+        self.browser = self.ua_classifier[pattern_index][0] if pattern_index is not None else None
+        if profiler is not None:
+            started = profiler.record(self.profiler_name, "classify", started)
+            profiler.hit(self.profiler_name, pattern_index, self.browser)
 
         if self.browser is None and not self.bot_status:
             return None
 
+        if self.fields is not None and "product" not in self.fields and self.detail_fields.isdisjoint(self.fields):
+            return self
+
         self._separate_user_agent_components()
         self.components.append(Product(self.raw_components[0]))
+        if profiler is not None:
+            started = profiler.record(self.profiler_name, "tokenize", started)
 
         if self.browser is None and self.bot_status:
             return self
 
-        self._extract_details()
+        if self.fields is None or not self.detail_fields.isdisjoint(self.fields):
+            self._extract_details()
+            if profiler is not None:
+                profiler.record(self.profiler_name, "extract_details", started)
 
         return self
 
-    def _preprocess_user_agent(self):
-        space_included_platform = re.findall(
-            r"^[\s\w]+/[\d\.]+", self.user_agent)
-        if len(space_included_platform) > 0:
-            self.user_agent = re.sub(
-                r"^[\s\w]+/[\d\.]+", space_included_platform[0].replace(" ", ""), self.user_agent)
-
-    def _separate_user_agent_components(self):
-        current_word = ""
-        inside_parentheses = False
-        for char_index, char in enumerate(self.user_agent):
-            if char == "(":
-                inside_parentheses = True
-                if current_word != "":
-                    self.raw_components.append(current_word)
-
-                current_word = ""
-            elif char == ")":
-                inside_parentheses = False
-                if current_word != "":
-                    self.raw_components.append(current_word)
-                current_word = ""
-            elif char == " ":
-                if inside_parentheses:
-                    current_word += char
-                else:
-                    if current_word != "":
-                        self.raw_components.append(current_word)
-
-                    current_word = ""
-            else:
-                current_word += char
-
-            if char_index == len(self.user_agent)-1:
-                if current_word != "":
-                    self.raw_components.append(current_word)
+    def _classify(self):
+        # Returns the index of the first matching entry of ua_classifier, or None
 
-    def _extract_details(self):
-        if self.browser == "firefox":
-            details = self.raw_components[1].split("; ")
-            gecko_release_version = details[-1]
-            details.remove(details[-1])
-            for term in details:
-                if self._is_device(term):
-                    self.components.append(Device(term))
-                    details.remove(term)
-
-            if self.bot_status:
-                compatibility = [element for element in self.raw_components[2:]
-                                 if "Firefox" not in element and bool(re.match(r".+/.+", element)) and not bool(re.match(r"compatible;\s.+https?://.+/.+", element))]
-            else:
-                compatibility = [element for element in self.raw_components[2:]
-                                 if "Firefox" not in element and bool(re.match(r".+/.+", element))]
-
-            browser = [element for element in self.raw_components[2:]
-                       if "Firefox" in element]
-            compatibility = [Product(item) for item in compatibility]
-            if len(browser) == 1:
-                browser = browser[0]
-            else:
-                browser = self.browser.capitalize() + "/"
-            self.components.append(Browser(
-                browser, compatibility=compatibility, gecko_release_version=gecko_release_version))
-
-            self.components.append(OS(details, self.devices_list))
-
-        elif self.browser == "chrome":
-            details = self.raw_components[1].split("; ")
-            for term in details:
-                if self._is_device(term):
-                    self.components.append(Device(term))
-                    details.remove(term)
-
-            if self.bot_status:
-                compatibility = [element for element in self.raw_components[4:]
-                                 if "Chrome" not in element and bool(re.match(r".+/.+", element)) and not bool(re.match(r"compatible;\s.+https?://.+/.+", element))]
-            else:
-                compatibility = [element for element in self.raw_components[4:]
-                                 if "Chrome" not in element and bool(re.match(r".+/.+", element))]
-
-            self.components.append(OS(details, self.devices_list))
-
-            browser = [element for element in self.raw_components[2:]
-                       if "Chrome" in element][0]
-            compatibility = [Product(item) for item in compatibility]
-            self.components.append(Browser(
-                browser, compatibility=compatibility))
-            self.layout_browser_engine = Product(self.raw_components[2])
-
-        elif self.browser == "opera":
-            details = self.raw_components[1].split("; ")
-            for term in details:
-                if self._is_device(term):
-                    self.components.append(Device(term))
-                    details.remove(term)
-
-            if self.bot_status:
-                compatibility = [element for element in self.raw_components[4:]
-                                 if "OPR" not in element and bool(re.match(r".+/.+", element)) and not bool(re.match(r"compatible;\s.+https?://.+/.+", element))]
-            else:
-                compatibility = [element for element in self.raw_components[4:]
-                                 if "OPR" not in element and bool(re.match(r".+/.+", element))]
-
-            self.components.append(OS(details, self.devices_list))
-
-            browser = [element for element in self.raw_components[2:]
-                       if "OPR" in element][0]
-            compatibility = [Product(item) for item in compatibility]
-            self.components.append(Browser(
-                browser, compatibility=compatibility))
-            self.layout_browser_engine = Product(self.raw_components[2])
-
-        elif self.browser == "safari":
-            if bool(re.match(r"Mozilla/.+", self.raw_components[0])):
-                details = self.raw_components[1].split("; ")
-                for term in details:
-                    if self._is_device(term):
-                        device_build = [
-                            element for element in self.raw_components[4:] if "Mobile" in element]
-                        device_build = device_build[0] if len(
-                            device_build) == 1 else None
-                        self.components.append(
-                            Device(term, device_build=device_build))
-                        details.remove(term)
-
-                if self.bot_status:
-                    compatibility = [element for element in self.raw_components[4:]
-                                     if "Safari" not in element and "Version" not in element and "Mobile" not in element and bool(re.match(r".+/.+", element)) and not bool(re.match(r"compatible;\s.+https?://.+/.+", element))]
-                else:
-                    compatibility = [element for element in self.raw_components[4:]
-                                     if "Safari" not in element and "Version" not in element and "Mobile" not in element and bool(re.match(r".+/.+", element))]
-
-                self.components.append(OS(details, self.devices_list))
-
-                version = [element for element in self.raw_components[4:]
-                           if "Version" in element]
-                version = version[0] if len(version) == 1 else None
-                browser = [element for element in self.raw_components[2:]
-                           if "Safari" in element][0]
-                compatibility = [Product(item) for item in compatibility]
-                self.components.append(Browser(
-                    browser, compatibility=compatibility, version=version))
-                self.layout_browser_engine = Product(self.raw_components[2])
-
-            elif bool(re.match(r"Safari/.+", self.raw_components[0])):
-                if self.bot_status:
-                    compatibility = [element for element in self.raw_components[1:]
-                                     if bool(re.match(r".+/.+", element)) and not bool(re.match(r"compatible;\s.+https?://.+/.+", element))]
-                else:
-                    compatibility = [element for element in self.raw_components[1:] if bool(
-                        re.match(r".+/.+", element))]
-
-                os_type = [element for element in self.raw_components[1:]
-                           if element not in compatibility]
-                os = "macOS"+"; "+os_type[0] if len(os_type) > 0 else "macOS"
-                self.components.append(OS(os, self.devices_list))
-
-                compatibility = [Product(item) for item in compatibility]
-                self.components.append(
-                    Browser(self.browser.capitalize()+"/", compatibility=compatibility))
-
-            elif bool(re.match(r"MobileSafari/.+", self.raw_components[0])):
-                if self.bot_status:
-                    compatibility = [element for element in self.raw_components[1:]
-                                     if bool(re.match(r".+/.+", element)) and not bool(re.match(r"compatible;\s.+https?://.+/.+", element))]
-                else:
-                    compatibility = [element for element in self.raw_components[1:] if bool(
-                        re.match(r".+/.+", element))]
-
-                self.components.append(OS("macOS", self.devices_list))
-
-                compatibility = [Product(item) for item in compatibility]
-                self.components.append(
-                    Browser(self.browser.capitalize()+"/", compatibility=compatibility))
-
-        elif self.browser == "ie":
-            details = self.raw_components[1].split("; ")[3:]
-            for term in details:
-                if self._is_device(term):
-                    self.components.append(Device(term))
-                    details.remove(term)
+        # only the patterns which can start with the user agent's leading product token are tried
+        slash = self.user_agent.find("/")
+        if slash == -1:
+            candidates = self.ua_fallback
+        else:
+            candidates = self.ua_dispatch.get(self.user_agent[:slash + 1], self.ua_fallback)
 
-            compatibility = details
+        classifier = self.ua_classifier
+        for index in candidates:
+            if classifier[index][1].match(self.user_agent):
+                return index
 
-            self.components.append(
-                OS(self.raw_components[1].split("; ")[2], self.devices_list))
-
-            compatibility = [Product(item) for item in compatibility]
-            self.components.append(Browser(self.raw_components[1].split(
-                "; ")[1].replace(" ", "/"), compatibility=compatibility))
-
-        elif self.browser == "browserless":
-            if bool(re.match(r"^Mozilla/[\.\d]+$", self.raw_components[0])):
-                pass
-            elif bool(re.match(r"Mozilla/.+", self.raw_components[0])):
-                details = self.raw_components[1].split("; ")
-                for term in details:
-                    if self._is_device(term):
-                        device_build = [
-                            element for element in self.raw_components[4:] if "Mobile" in element]
-                        device_build = device_build[0] if len(
-                            device_build) == 1 else None
-                        self.components.append(
-                            Device(term, device_build=device_build))
-                        details.remove(term)
-
-                if self.bot_status:
-                    compatibility = [element for element in self.raw_components[4:]
-                                     if "Mobile" not in element and bool(re.match(r".+/.+", element)) and not bool(re.match(r"compatible;\s.+https?://.+/.+", element))]
-                else:
-                    compatibility = [element for element in self.raw_components[4:]
-                                     if "Mobile" not in element and bool(re.match(r".+/.+", element))]
-
-                self.components.append(OS(details, self.devices_list))
-
-                compatibility = [Product(item) for item in compatibility]
-                self.components.append(
-                    Browser("", compatibility=compatibility))
-                self.layout_browser_engine = Product(self.raw_components[2])
-
-            elif bool(re.match(r"curl/.+", self.raw_components[0])):
-                if len(self.raw_components) > 1:
-                    if self.bot_status:
-                        compatibility = [element for element in self.raw_components[2:]
-                                         if bool(re.match(r".+/.+", element)) and not bool(re.match(r"compatible;\s.+https?://.+/.+", element))]
-                    else:
-                        compatibility = [element for element in self.raw_components[2:] if bool(
-                            re.match(r".+/.+", element))]
-
-                    self.components.append(
-                        OS(self.raw_components[1]+"; ", self.devices_list))
-
-                    compatibility = [Product(item) for item in compatibility]
-                    self.components.append(
-                        Browser("", compatibility=compatibility))
-
-            elif bool(re.match(r"com\.apple\.WebKit\.WebContent/.+", self.raw_components[0])):
-                if self.bot_status:
-                    compatibility = [element for element in self.raw_components[1:]
-                                     if bool(re.match(r".+/.+", element)) and not bool(re.match(r"compatible;\s.+https?://.+/.+", element))]
-                else:
-                    compatibility = [element for element in self.raw_components[1:] if bool(
-                        re.match(r".+/.+", element))]
+        return None
 
-                os_type = [element for element in self.raw_components[1:]
-                           if element not in compatibility]
-                os = "macOS"+"; "+os_type[0] if len(os_type) > 0 else "macOS"
-                self.components.append(OS(os, self.devices_list))
+    def _preprocess_user_agent(self):
+        space_included_platform = patterns.space_included_platform_pattern.match(
+            self.user_agent)
+        if space_included_platform is not None:
+            self.user_agent = space_included_platform.group().replace(
+                " ", "") + self.user_agent[space_included_platform.end():]
 
-                compatibility = [Product(item) for item in compatibility]
-                self.components.append(
-                    Browser("", compatibility=compatibility))
+    def _separate_user_agent_components(self):
+        self.raw_components.extend(tokenize_user_agent(self.user_agent))
 
-        else:
-            pass
+    def _extract_details(self):
+        # The extractor is picked by the classification and, for the classes that cover several
+        # kinds of user agents, by the leading product token (e.g. "Safari/" or "curl/")
+        handler = self.detail_handlers.get((self.browser, None))
+        if handler is None:
+            product = self.raw_components[0]
+            slash = product.find("/")
+            if slash == -1 or len(product) == slash + 1 or product[slash + 1] == "\n":
+                return
+            handler = self.detail_handlers.get((self.browser, product[:slash + 1]))
+            if handler is None:
+                return
+
+        handler(self)
 
     def _check_bot(self):
-        bot = re.findall(r"\(compatible;\s.+https?://.+/.*\)", self.user_agent)
-        if len(bot) > 0:
-            self.bot_status = True
-            self.components.append(Bot(bot[0][1:-1], URLParser))
+        bot = patterns.compatible_bot_span(self.user_agent)
+        if bot is None:
+            bot = patterns.linked_bot_span(self.user_agent)
 
-        elif bool(re.match(r".+/.+\s?\(\+?https?://.+/.*?\)", self.user_agent)):
+        if bot is not None:
             self.bot_status = True
             self.components.append(
-                Bot(re.findall(r"\(\+?https?://.+/.*\)", self.user_agent)[0][1:-1], URLParser))
-
-    def _is_device(self, term):
-        if term in self.devices_list:
-            return True
+                Bot(self.user_agent[bot[0] + 1:bot[1] - 1], URLParser))
 
-        return False
 
-    def _mine_dictionary(self, key_name, dictionary, new_dictionary):
-        for key in dictionary.keys():
-            if key_name == "":
-                new_key = key
-            else:
-                new_key = key_name + "." + key
-
-            if isinstance(dictionary[key], dict):
-                self._mine_dictionary(new_key, dictionary[key], new_dictionary)
-
-            elif isinstance(dictionary[key], list):
-                new_key_temp = copy.deepcopy(new_key)
-                for idx, element in enumerate(dictionary[key]):
-                    new_key = new_key_temp + "." + str(idx+1)
-                    if isinstance(element, dict):
-                        self._mine_dictionary(
-                            new_key, element, new_dictionary)
-
-                    else:
-                        new_dictionary[new_key] = element
-
-            elif isinstance(dictionary[key], str) or isinstance(dictionary[key], int) or isinstance(dictionary[key], float) or isinstance(dictionary[key], bool):
-                new_dictionary[new_key] = dictionary[key]
+class URLParser(Parser):
 
+    flat_raw_keys = ("query.query",)
 
-class URLParser(Parser):
+    profiler_name = "url"
 
     protocol_port_map_dict = {
         "acap": 674,
@@ -443,20 +457,37 @@ class URLParser(Parser):
         'html', 'htm', 'css', 'js', 'jsx', 'less', 'scss', 'wasm',
     ]
 
+    # longer urls are not parsed; parse() leaves the result empty and sets truncated
+    max_length = 8192
+
+    __slots__ = ("url", "raw_components", "components", "protocol", "port",
+                 "fragment_identifiers", "target_accessed", "fields", "truncated")
+
+    @classmethod
+    def rules_tables(cls):
+        return [cls.protocol_port_map_dict, cls.file_formats, cls.max_length, public_suffixes.list_digest(),
+                Domain.private_suffixes, Subdirectories.language_codes, Subdirectories.region_variants,
+                Query.query_keys, Query.query_stop_early]
+
     def __init__(self, url):
-        self.url = re.sub(r"^\+", "", url)
         self.raw_components = []
         self.components = []
+        self._reset(url)
+
+    def _reset(self, url):
+        self.url = url[1:] if url.startswith("+") else url
+        self.raw_components.clear()
+        self.components.clear()
         self.protocol = None
         self.port = None
         self.fragment_identifiers = []
         self.target_accessed = "page"
+        self.fields = None
+        self.truncated = False
 
-    def components_as_dictionary(self):
-        components_list = []
-        for component in self.components:
-            components_list.append(
-                (component.component_type, component.get_as_dict()))
+    def _component_items(self):
+        components_list = [(component.component_type, component)
+                           for component in self.components]
 
         components_list.append(("protocol", self.protocol))
         components_list.append(("port", self.port))
@@ -464,41 +495,142 @@ class URLParser(Parser):
             ("fragment_identifiers", self.fragment_identifiers))
         components_list.append(("target_type", self.target_accessed))
 
-        return dict(components_list)
+        return components_list
 
-    def components_as_flat_dictionary(self):
-        flat_dictionary = {}
-        components_dict = self.components_as_dictionary()
-        self._mine_dictionary("", components_dict, flat_dictionary)
+    def parse(self, fields=None):
+        # fields optionally restricts the result to the given top-level keys
+        self.fields = frozenset(fields) if fields is not None else None
+        if self.max_length is not None and len(self.url) > self.max_length:
+            self.truncated = True
+            return self
 
-        return flat_dictionary
+        profiler = self.profiler
+        if profiler is not None:
+            started = profiler.clock()
+
+        is_url = patterns.url_pattern.match(self.url)
+        if profiler is not None:
+            started = profiler.record(self.profiler_name, "match", started)
+        if not is_url:
+            return self
+
+        parts = self._split()
+        if parts is not None:
+            host, subdirectories = parts
+            self._detect_port_from_protocol()
+            self.components.append(Domain(host))
+            if profiler is not None:
+                started = profiler.record(self.profiler_name, "domain", started)
+
+            self._add_path(subdirectories)
+            if profiler is not None:
+                profiler.record(self.profiler_name, "path", started)
 
-    def parse(self):
-        if not bool(re.match(r"\w+://.+/.*?", self.url)):
             return self
 
         self._detect_fragment_ids()
+        if profiler is not None:
+            started = profiler.record(self.profiler_name, "fragments", started)
 
-        protocol_domain_part = re.findall(
-            r"(\w*://)*([\[\]:@A-Za-z_0-9.-]+).*", self.url)[0]
+        protocol_domain_part = patterns.protocol_domain_pattern.findall(self.url)[0]
         if len(protocol_domain_part) > 0:
             if protocol_domain_part[0] != "":
                 self.protocol = protocol_domain_part[0][:-3]
 
-            self._detect_port()
-            self.components.append(Domain(protocol_domain_part[1]))
+            # the host without the port, which _detect_port removes from the url
+            host = protocol_domain_part[1]
+            port_text = self._detect_port()
+            if port_text is not None:
+                host = host.replace(port_text, "")
+            self.components.append(Domain(host))
+            if profiler is not None:
+                started = profiler.record(self.profiler_name, "domain", started)
 
             subdirectories = self.url.replace(
                 "".join(protocol_domain_part), "")
 
-            if bool(re.match(r".+\?.+=.+", subdirectories)):  # check whether the url is a query
-                self.components.append(Query(subdirectories))
-            elif bool(re.match(r"/.+", subdirectories)):
-                self.components.append(Subdirectories(subdirectories))
-                self.target_accessed = self._detect_target_typle()
+            self._add_path(subdirectories)
+            if profiler is not None:
+                profiler.record(self.profiler_name, "path", started)
 
         return self
 
+    def _split(self):
+        # Splits a valid url (see parse) by index, without rewriting it. Returns the host and the
+        # text after it with the port and fragment taken out, having set the protocol, port and
+        # fragment; or None, changing nothing, for the unusual urls on which the replace-based
+        # steps of the general path do more than cut those parts out (a line break, several
+        # "://", or a fragment, port or scheme-and-host repeated elsewhere in the url)
+        url = self.url
+        if "\n" in url:
+            return None
+
+        # a valid url starts with r"\w+://", so the first "://" ends the scheme
+        host_start = url.find("://") + 3
+        if url.find("://", host_start) != -1:
+            return None
+        host = patterns.host_run_pattern.match(url, host_start)
+        if host is None:
+            return None
+        host_end = host.end()
+
+        # a fragment has no "#" in it, so it can only start at the last one
+        fragment = None
+        body_end = len(url)
+        hash_mark = url.rfind("#", host_end)
+        if hash_mark != -1 and patterns.fragment_pattern.match(url, hash_mark):
+            fragment = url[hash_mark + 1:]
+            body_end = hash_mark
+            if url.find(url[hash_mark:], 0, hash_mark) != -1:
+                return None
+
+        # no port can start in the scheme, and one in the host comes before any in the path
+        port = None
+        port_found = None
+        if ":" in host.group():
+            port_found = patterns.host_port_pattern.search(url, host_start, host_end)
+        if port_found is None and url.find(":", host_end, body_end) != -1:
+            port_found = patterns.host_port_pattern.search(url, host_end, body_end)
+        if port_found is not None:
+            port = patterns.port_pattern.search(port_found.group()).group()
+            port_start = url.find(port, port_found.start(), body_end)
+            if url.find(port, 0, port_start) != -1 or url.find(port, port_start + 1, body_end) != -1:
+                return None
+
+        # what the general path gets by removing every occurrence of scheme and host
+        scheme_host = url[:host_end]
+        host = host.group()
+        if port is None:
+            if url.find(scheme_host, host_end, body_end) != -1:
+                return None
+            subdirectories = url[host_end:body_end]
+        else:
+            body = url[:port_start] + url[port_start + len(port):body_end]
+            if port_start < host_end:  # the port was in the host, so nothing is removed
+                if scheme_host in body:
+                    return None
+                subdirectories = body
+                host = url[host_start:port_start] + url[port_start + len(port):host_end]
+            else:
+                if body.find(scheme_host, host_end) != -1:
+                    return None
+                subdirectories = body[host_end:]
+
+        self.protocol = url[:host_start - 3]
+        if port is not None:
+            self.port = port[1:]
+        if fragment is not None:
+            self.fragment_identifiers.append(fragment)
+
+        return host, subdirectories
+
+    def _add_path(self, subdirectories):
+        if patterns.is_query(subdirectories):  # check whether the url is a query
+            self.components.append(Query(subdirectories))
+        elif patterns.starts_with(subdirectories, "/"):
+            self.components.append(Subdirectories(subdirectories))
+            self.target_accessed = self._detect_target_typle()
+
     def _detect_target_typle(self):
         subdirectories = self.components[-1].get_as_dict()["subdirectories"]
         if len(subdirectories) > 0:
@@ -510,47 +642,26 @@ class URLParser(Parser):
                     return self.target_accessed
 
     def _detect_fragment_ids(self):
-        fragments = re.findall(r"#[A-Za-z_0-9]+$", self.url)
+        fragments = patterns.fragment_pattern.findall(self.url)
         if len(fragments) > 0:
             for idx, item in enumerate(fragments):
                 self.url = self.url.replace(item, "")
                 self.fragment_identifiers.append(item[1:])
 
     def _detect_port(self):
-        port_found = re.findall(r"[A-Za-z_0-9.-]+:\d+/?", self.url)
+        # returns the ":port" text removed from the url, if any
+        port_found = patterns.host_port_pattern.findall(self.url)
         if len(port_found) > 0:
-            self.port = re.findall(r":\d+", port_found[0])[0]
-            self.url = self.url.replace(self.port, "")
-            self.port = self.port[1:]
-        elif self.protocol is not None:
+            port = patterns.port_pattern.search(port_found[0]).group()
+            self.url = self.url.replace(port, "")
+            self.port = port[1:]
+            return port
+        else:
+            self._detect_port_from_protocol()
+            return None
+
+    def _detect_port_from_protocol(self):
+        if self.port is None and self.protocol is not None:
             port_num = self.protocol_port_map_dict.get(self.protocol, -1)
             if port_num != -1:
                 self.port = port_num
-
-    def _mine_dictionary(self, key_name, dictionary, new_dictionary):
-        for key in dictionary.keys():
-            if key_name == "":
-                new_key = key
-            else:
-                new_key = key_name + "." + key
-
-            if new_key == "query.query":
-                new_dictionary[new_key] = dictionary[key]
-                continue
-
-            if isinstance(dictionary[key], dict):
-                self._mine_dictionary(new_key, dictionary[key], new_dictionary)
-
-            elif isinstance(dictionary[key], list):
-                new_key_temp = copy.deepcopy(new_key)
-                for idx, element in enumerate(dictionary[key]):
-                    new_key = new_key_temp + "." + str(idx+1)
-                    if isinstance(element, dict):
-                        self._mine_dictionary(
-                            new_key, element, new_dictionary)
-
-                    else:
-                        new_dictionary[new_key] = element
-
-            elif isinstance(dictionary[key], str) or isinstance(dictionary[key], int) or isinstance(dictionary[key], float) or isinstance(dictionary[key], bool):
-                new_dictionary[new_key] = dictionary[key]